@@ -1,144 +1,530 @@
-from flask import Flask, render_template, request, send_file, jsonify
+from flask import Flask, Request, Response, render_template, request, send_file, jsonify
+from werkzeug.exceptions import HTTPException
 import os
 import shutil
 from datetime import datetime
 from hppdauto import run_hppd_comparison_for_date
 from werkzeug.utils import secure_filename
 import zipfile
+import tarfile
 import tempfile
-from uuid import uuid4
 import threading
+import concurrent.futures
+import hashlib
+import json
+import logging
+import logging.handlers
+import queue
+import atexit
+import glob
+import time
+import contextlib
+from collections import OrderedDict
+import redis
+
+try:
+    import zstandard
+except ImportError:  # In requirements.txt; without it (e.g. a hand-rolled install) .tar.zst uploads are refused
+    zstandard = None
+
+# Log records are queued and written by a listener thread, so job threads never block on stderr.
+# DEBUG (per-tick progress, upload details) is off unless LOG_LEVEL=DEBUG.
+_log_queue = queue.SimpleQueue()
+logging.root.addHandler(logging.handlers.QueueHandler(_log_queue))
+logging.root.setLevel(os.environ.get("LOG_LEVEL", "INFO"))
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
+log = logging.getLogger(__name__)
+
+UPLOAD_DIR = "/tmp"
+
+# Optional Redis shared by all gunicorn workers; when REDIS_URL is unset progress
+# lives in this process only and there is no result cache
+REDIS_URL = os.environ.get("REDIS_URL")
+RESULT_CACHE_TTL = 24 * 60 * 60  # Seconds a finished workbook stays reusable for identical uploads
+PROGRESS_TTL = 60 * 60  # Seconds a job's progress entry (and download link) stays visible
+redis_client = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+
+
+class HashingSpoolFile:
+    """Named upload file that BLAKE2b-hashes the bytes as Werkzeug writes them.
+
+    Gives the result cache its key without a second read of the upload."""
+
+    def __init__(self, file):
+        self._file = file
+        self._digest = hashlib.blake2b(digest_size=16)
+
+    def write(self, data):
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._digest.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """Spools each uploaded file straight into a named file in UPLOAD_DIR.
+
+    The background job opens these files by path, so uploads are written to
+    disk once instead of being copied out of Werkzeug's temporary file."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        spool = tempfile.NamedTemporaryFile(dir=UPLOAD_DIR, prefix="upload_", delete=False)
+        return HashingSpoolFile(spool) if redis_client is not None else spool
+
 
 app = Flask(__name__)
-progress_store = {}  # In-memory store for progress tracking
+app.request_class = UploadRequest
+# Downloads can be handed to a front-end server instead of going through a gunicorn thread; gunicorn on its
+# own already streams send_file() responses through sendfile(2) via wsgi.file_wrapper.
+# USE_X_SENDFILE=1 is for Apache (mod_xsendfile) or lighttpd only: Werkzeug then answers with an empty
+# body and an X-Sendfile filesystem path, which nginx doesn't understand (downloads would come out empty).
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE") == "1"
+# For nginx set X_ACCEL_REDIRECT_PREFIX (e.g. /protected/) to an `internal` location aliased to UPLOAD_DIR;
+# downloads then answer with X-Accel-Redirect: <prefix><file name>, a URI nginx serves itself
+X_ACCEL_REDIRECT_PREFIX = os.environ.get("X_ACCEL_REDIRECT_PREFIX")
+# Werkzeug refuses bodies whose Content-Length exceeds this before spooling anything (413 below)
+app.config["MAX_CONTENT_LENGTH"] = int(os.environ.get("MAX_UPLOAD_MB", "512")) * 1024 * 1024
+PROGRESS_STORE_MAX = 1024  # Jobs remembered in memory when Redis is not configured
+# /progress-stream checks for changes this often (with Redis, one GET each time), sends a keep-alive comment
+# when idle this long, and gives up after PROGRESS_STREAM_MAX seconds, or after PROGRESS_STREAM_UNKNOWN_GRACE
+# for an id with no progress entry (the upload sets one before it returns the id)
+PROGRESS_STREAM_INTERVAL = 1
+PROGRESS_STREAM_KEEPALIVE = 15
+PROGRESS_STREAM_MAX = 10 * 60
+PROGRESS_STREAM_UNKNOWN_GRACE = 5
+# Each open stream holds a server thread (gunicorn runs 8, see render.yaml); past this many, /progress-stream
+# answers 503 and the page falls back to polling /progress, so uploads and downloads always have threads left
+PROGRESS_STREAM_SLOTS = threading.BoundedSemaphore(int(os.environ.get("PROGRESS_STREAM_MAX_OPEN", "4")))
+
+# Upload jobs share one pool; past max_workers concurrent uploads, new jobs queue instead of piling up threads
+job_executor = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="hppd-job")
+atexit.register(job_executor.shutdown, wait=True)
+# Report archives are unpacked here while the job thread works through the templates; kept apart from
+# job_executor so a full job pool can never wait on its own extraction
+extract_executor = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="hppd-extract")
+atexit.register(extract_executor.shutdown, wait=True)
+
+# Per-member copy buffer: caps extraction memory regardless of member size while keeping
+# large xlsx/xls members to a handful of write() calls. Peak use is one buffer per running job.
+EXTRACT_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class ProgressStore:
+    """In-process progress entries, capped at maxsize and expired ttl seconds after their last update.
+
+    Entries that fall out take their output workbook with them."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # progress_id -> (monotonic time of last update, entry), oldest first
+        self._lock = threading.Lock()
+
+    def __setitem__(self, progress_id, entry):
+        with self._lock:
+            self._entries.pop(progress_id, None)
+            self._entries[progress_id] = (time.monotonic(), entry)
+            dropped = self._drop_stale()
+        remove_files(*dropped)
+
+    def get(self, progress_id, default=None):
+        with self._lock:
+            item = self._entries.get(progress_id)
+        if item is None or time.monotonic() - item[0] > self.ttl:
+            return default
+        return item[1]
+
+    def expire(self):
+        with self._lock:
+            dropped = self._drop_stale()
+        remove_files(*dropped)
+
+    def _drop_stale(self):
+        """Pop expired and overflowing entries (caller holds the lock); returns their output files."""
+        now = time.monotonic()
+        dropped = []
+        while self._entries:
+            updated_at, _ = next(iter(self._entries.values()))
+            if len(self._entries) <= self.maxsize and now - updated_at <= self.ttl:
+                break
+            _, (_, entry) = self._entries.popitem(last=False)
+            if entry.get("file_path"):
+                dropped.append(entry["file_path"])
+        return dropped
+
+
+progress_store = ProgressStore(PROGRESS_STORE_MAX, PROGRESS_TTL)  # Used when Redis is not configured
+
+
+def sweep_outputs(interval=60):
+    """Periodically drop expired progress entries and output workbooks older than PROGRESS_TTL.
+
+    Covers the Redis mode too, where key expiry alone would leave the files in UPLOAD_DIR."""
+    while True:
+        time.sleep(interval)
+        progress_store.expire()
+        cutoff = time.time() - PROGRESS_TTL
+        for path in glob.glob(os.path.join(UPLOAD_DIR, "hppd_output_*.xlsx")):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def set_progress(progress_id, percent, status, completed=False, file_path=None):
+    """Publish the current state of a job; the only writer of the progress store."""
+    entry = {"percent": percent, "status": status, "completed": completed, "file_path": file_path}
+    if redis_client is not None:
+        try:
+            redis_client.setex(f"prog:{progress_id}", PROGRESS_TTL, json.dumps(entry))
+            return
+        except redis.RedisError as e:
+            log.warning("[%s] Progress store unavailable, keeping it in memory: %s", progress_id, e)
+    progress_store[progress_id] = entry
+
+
+class ThrottledProgress:
+    """progress_callback that publishes at most every min_dt seconds, unless the percentage moved by min_dp or more.
+
+    Keeps a chatty comparison from turning every tick into a store (or Redis) write; 100% is always published."""
+
+    def __init__(self, progress_id, min_dt=0.1, min_dp=1.0):
+        self.progress_id = progress_id
+        self.min_dt = min_dt
+        self.min_dp = min_dp
+        self.last_pct = None
+        self.last_t = 0.0
+
+    def __call__(self, pct, msg):
+        now = time.monotonic()
+        if (self.last_pct is not None and pct < 100
+                and abs(pct - self.last_pct) < self.min_dp and now - self.last_t < self.min_dt):
+            return
+        self.last_pct = pct
+        self.last_t = now
+        log.debug("[%s] %s%% - %s", self.progress_id, pct, msg)
+        set_progress(self.progress_id, pct, msg)
+
+
+def get_progress_entry(progress_id, default=None):
+    """Current state of a job as written by set_progress, or default."""
+    if redis_client is not None:
+        try:
+            raw = redis_client.get(f"prog:{progress_id}")
+            if raw is not None:
+                return json.loads(raw)
+        except redis.RedisError as e:
+            log.warning("[%s] Progress store unavailable: %s", progress_id, e)
+    return progress_store.get(progress_id, default)
+
+
+def remove_files(*paths):
+    """Remove spooled uploads or stale outputs, ignoring ones that are already gone."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def output_path_for(progress_id):
+    return os.path.join(UPLOAD_DIR, f"hppd_output_{progress_id}.xlsx")
+
+
+def move_output(src, dst):
+    """Move the finished workbook to its download path.
+
+    A plain rename when both paths share a filesystem, a copy otherwise. The
+    copy is shutil.copyfile, which already goes through sendfile(2) on Linux;
+    the copy's mtime is when it became downloadable, which is what
+    sweep_outputs ages it by."""
+    if os.stat(src).st_dev == os.stat(os.path.dirname(dst)).st_dev:
+        try:
+            os.replace(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# gzip, bzip2 and xz headers; tarfile's "r|*" mode handles all three
+TAR_COMPRESSION_MAGICS = (b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00")
+
+
+def open_archive(path, stack):
+    """Open an uploaded zip or tar archive (plain, gz, bz2, xz, or zst when zstandard is installed).
+
+    The format is sniffed from the leading bytes: a tar of stored xlsx files
+    can look like a zip to zipfile.is_zipfile(). Tar archives are opened in
+    streaming mode and can only be read once, in order. Everything opened is
+    registered on stack, an ExitStack."""
+    f = stack.enter_context(open(path, "rb"))
+    head = f.read(262)
+    f.seek(0)
+    if head.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ValueError("zstd-compressed archives need the zstandard package")
+        f = stack.enter_context(zstandard.ZstdDecompressor().stream_reader(f))
+        return stack.enter_context(tarfile.open(fileobj=f, mode="r|"))
+    if head[257:262] == b"ustar" or head.startswith(TAR_COMPRESSION_MAGICS):
+        return stack.enter_context(tarfile.open(fileobj=f, mode="r|*"))
+    return stack.enter_context(zipfile.ZipFile(f))
+
+
+def iter_archive_members(archive, dest):
+    """Extract the members of an archive from open_archive one at a time, yielding (filepath, filename) for each file.
+
+    Each member is copied through a fixed EXTRACT_BUFFER_SIZE buffer, and
+    members whose path would resolve outside dest (zip-slip) are skipped, as
+    are tar links and device entries. Handing this generator to
+    run_hppd_comparison_for_date lets parsing of the first files overlap
+    extraction of the rest."""
+    dest_root = os.path.realpath(dest)
+    made_dirs = {dest_root}  # Folders already created for this archive; skips a makedirs() per member
+
+    def ensure_dir(path):
+        if path not in made_dirs:
+            os.makedirs(path, exist_ok=True)
+            made_dirs.add(path)
+
+    if isinstance(archive, zipfile.ZipFile):
+        members = ((info.filename, info.is_dir(), info, archive.open) for info in archive.infolist())
+    else:
+        members = ((info.name, info.isdir(), info, archive.extractfile) for info in archive
+                   if info.isdir() or info.isfile())
+
+    for name, is_dir, info, open_member in members:
+        out_path = os.path.realpath(os.path.join(dest_root, name))
+        if os.path.commonpath([dest_root, out_path]) != dest_root:
+            continue
+        if is_dir:
+            ensure_dir(out_path)
+            continue
+        ensure_dir(os.path.dirname(out_path))
+        with open_member(info) as src, open(out_path, "wb", buffering=EXTRACT_BUFFER_SIZE) as dst:
+            shutil.copyfileobj(src, dst, EXTRACT_BUFFER_SIZE)
+        yield out_path, os.path.basename(out_path)
+
+
+def iter_extracted(future):
+    """Yield the (filepath, filename) pairs of an extraction running on extract_executor once it finishes."""
+    yield from future.result()
+
+
+def process_files(progress_id, temp_template_path, temp_report_path, date_str, cache_key=None):
+    """Extract both uploaded archives, run the comparison and record the output file.
+
+    Takes only plain strings so the job can be handed to any executor or queue.
+    The job owns both uploaded files and removes them when it finishes. When
+    cache_key is given the finished workbook is stored under it in Redis."""
+    try:
+        log.debug("[%s] Preparing temp directories...", progress_id)
+        # Work under UPLOAD_DIR so the finished workbook can be renamed, not copied, into place
+        with tempfile.TemporaryDirectory(dir=UPLOAD_DIR) as temp_dir:
+            upload_folder = os.path.join(temp_dir, "uploads")
+            os.makedirs(upload_folder, exist_ok=True)
+
+            archives = contextlib.ExitStack()
+
+            template_path = os.path.join(upload_folder, "templates")
+            os.makedirs(template_path, exist_ok=True)
+            try:
+                template_archive = open_archive(temp_template_path, archives)
+            except Exception as e:
+                archives.close()
+                set_progress(progress_id, 0, f"Error extracting template archive: {str(e)}", completed=True)
+                log.error("[%s] Template extraction failed: %s", progress_id, e)
+                return
+
+            report_path = os.path.join(upload_folder, "reports")
+            os.makedirs(report_path, exist_ok=True)
+            try:
+                report_archive = open_archive(temp_report_path, archives)
+            except Exception as e:
+                archives.close()
+                set_progress(progress_id, 0, f"Error extracting report archive: {str(e)}", completed=True)
+                log.error("[%s] Report extraction failed: %s", progress_id, e)
+                return
+
+            try:
+                log.debug("[%s] Starting run_hppd_comparison_for_date", progress_id)
+                # Template members are extracted lazily as the comparison asks for them, while the
+                # report archive is unpacked alongside on extract_executor
+                with archives:
+                    reports_extracted = extract_executor.submit(list, iter_archive_members(report_archive, report_path))
+                    # Registered last, so it runs first on exit: never close an archive mid-extraction
+                    archives.callback(concurrent.futures.wait, [reports_extracted])
+                    output_path = run_hppd_comparison_for_date(
+                        iter_archive_members(template_archive, template_path),
+                        iter_extracted(reports_extracted),
+                        date_str,
+                        upload_folder,
+                        progress_callback=ThrottledProgress(progress_id)
+                    )
+                log.debug("[%s] run_hppd_comparison_for_date finished", progress_id)
+
+                permanent_path = output_path_for(progress_id)
+                move_output(output_path, permanent_path)
+
+                if cache_key:
+                    try:
+                        with open(permanent_path, "rb") as f:
+                            redis_client.setex(cache_key, RESULT_CACHE_TTL, f.read())
+                    except redis.RedisError as e:
+                        log.warning("[%s] Could not cache result: %s", progress_id, e)
+
+                set_progress(progress_id, 100, "✅ Analysis complete! Download ready.", completed=True, file_path=permanent_path)
+                log.debug("[%s] File saved to %s", progress_id, permanent_path)
+
+            except Exception as e:
+                set_progress(progress_id, 0, f"Error processing files: {str(e)}", completed=True)
+                log.exception("[%s] ERROR in processing: %s", progress_id, e)
+
+    except Exception as e:
+        set_progress(progress_id, 0, f"Unexpected error: {str(e)}", completed=True)
+        log.exception("[%s] UNEXPECTED error: %s", progress_id, e)
+
+    finally:
+        remove_files(temp_template_path, temp_report_path)
+
+
+threading.Thread(target=sweep_outputs, name="hppd-output-sweeper", daemon=True).start()
+
 
 @app.route("/", methods=["GET", "POST"])
 def index():
     if request.method == "POST":
+        spooled_paths = set()
         try:
-            template_file = request.files.get("template_zip")
-            report_file = request.files.get("report_zip")
             date_str = request.form.get("date")
             progress_id = request.form.get("progress_id")
+            # Every uploaded file is already on disk (see UploadRequest); anything not handed to the job is removed below
+            spooled_paths = {f.stream.name for _, f in request.files.items(multi=True)}
 
-            print("DEBUG: Upload check")
-            print("template_file:", template_file)
-            print("report_file:", report_file)
-            print("date_str:", date_str)
-            print("progress_id:", progress_id)
+            # Reject a bad date before anything else looks at the uploads
+            try:
+                date = datetime.strptime(date_str, "%Y-%m-%d") if date_str else None
+            except ValueError:
+                return jsonify({"error": "Invalid date, expected YYYY-MM-DD"}), 400
 
-            if not template_file or not report_file or not date_str or not progress_id:
-                return jsonify({"error": "Missing required files, date, or progress ID"}), 400
+            template_file = request.files.get("template_zip")
+            report_file = request.files.get("report_zip")
 
-            date = datetime.strptime(date_str, "%Y-%m-%d")
+            log.debug("Upload check: template_file=%s report_file=%s date_str=%s progress_id=%s",
+                      template_file, report_file, date_str, progress_id)
 
-            # Save uploaded files to disk immediately
-            temp_template_path = os.path.join("/tmp", f"template_{uuid4().hex}.zip")
-            temp_report_path = os.path.join("/tmp", f"report_{uuid4().hex}.zip")
-            template_file.save(temp_template_path)
-            report_file.save(temp_report_path)
+            if not template_file or not report_file or not date or not progress_id:
+                return jsonify({"error": "Missing required files, date, or progress ID"}), 400
 
-            progress_store[progress_id] = {"percent": 0, "status": "Initializing...", "completed": False, "file_path": None}
+            # Close the spooled files so everything Werkzeug wrote is on disk before the job opens them
+            temp_template_path = template_file.stream.name
+            temp_report_path = report_file.stream.name
+            template_file.close()
+            report_file.close()
+            date_str = date.strftime("%Y-%m-%d")
 
-            def process_files():
+            # Identical uploads for the same date produce the same workbook; serve it from Redis when we have it.
+            # The digests were computed while the uploads were spooled (see HashingSpoolFile).
+            cache_key = None
+            if redis_client is not None:
                 try:
-                    def update_progress(pct, msg):
-                        print(f"[{progress_id}] {pct}% - {msg}")
-                        progress_store[progress_id] = {"percent": pct, "status": msg, "completed": False, "file_path": None}
-
-                    print(f"[{progress_id}] Preparing temp directories...")
-                    with tempfile.TemporaryDirectory() as temp_dir:
-                        upload_folder = os.path.join(temp_dir, "uploads")
-                        os.makedirs(upload_folder, exist_ok=True)
-
-                        template_path = os.path.join(upload_folder, "templates")
-                        os.makedirs(template_path, exist_ok=True)
-                        try:
-                            with zipfile.ZipFile(temp_template_path, 'r') as zip_ref:
-                                zip_ref.extractall(template_path)
-                        except Exception as e:
-                            progress_store[progress_id] = {"percent": 0, "status": f"Error extracting template zip: {str(e)}", "completed": True, "file_path": None}
-                            print(f"[{progress_id}] Template extraction failed: {e}")
-                            return
-
-                        report_path = os.path.join(upload_folder, "reports")
-                        os.makedirs(report_path, exist_ok=True)
-                        try:
-                            with zipfile.ZipFile(temp_report_path, 'r') as zip_ref:
-                                zip_ref.extractall(report_path)
-                        except Exception as e:
-                            progress_store[progress_id] = {"percent": 0, "status": f"Error extracting report zip: {str(e)}", "completed": True, "file_path": None}
-                            print(f"[{progress_id}] Report extraction failed: {e}")
-                            return
-
-                        print(f"[{progress_id}] 🧪 Template path exists: {os.path.isdir(template_path)}, contains {len(os.listdir(template_path))} files")
-                        print(f"[{progress_id}] 🧪 Report path exists: {os.path.isdir(report_path)}, contains {len(os.listdir(report_path))} files")
-
-                        try:
-                            print(f"[{progress_id}] Starting run_hppd_comparison_for_date")
-                            output_path = run_hppd_comparison_for_date(
-                                template_path,
-                                report_path,
-                                date.strftime("%Y-%m-%d"),
-                                upload_folder,
-                                progress_callback=update_progress
-                            )
-                            print(f"[{progress_id}] run_hppd_comparison_for_date finished")
-
-                            permanent_path = os.path.join("/tmp", f"hppd_output_{progress_id}.xlsx")
-                            shutil.copy2(output_path, permanent_path)
-
-                            progress_store[progress_id] = {
-                                "percent": 100,
-                                "status": "✅ Analysis complete! Download ready.",
-                                "completed": True,
-                                "file_path": permanent_path
-                            }
-                            print(f"[{progress_id}] File saved to {permanent_path}")
-
-                        except Exception as e:
-                            progress_store[progress_id] = {
-                                "percent": 0,
-                                "status": f"Error processing files: {str(e)}",
-                                "completed": True,
-                                "file_path": None
-                            }
-                            print(f"[{progress_id}] ERROR in processing: {e}")
-
-                except Exception as e:
-                    progress_store[progress_id] = {
-                        "percent": 0,
-                        "status": f"Unexpected error: {str(e)}",
-                        "completed": True,
-                        "file_path": None
-                    }
-                    print(f"[{progress_id}] UNEXPECTED error: {e}")
-
-            print(f"[{progress_id}] Launching thread...")
-            thread = threading.Thread(target=process_files)
-            thread.start()
-            print(f"[{progress_id}] Thread launched successfully.")
+                    cache_key = f"hppd:{template_file.stream.hexdigest()}:{report_file.stream.hexdigest()}:{date_str}"
+                    cached = redis_client.get(cache_key)
+                except redis.RedisError as e:
+                    log.warning("[%s] Result cache unavailable: %s", progress_id, e)
+                    cache_key = cached = None
+                if cached:
+                    permanent_path = output_path_for(progress_id)
+                    with open(permanent_path, "wb") as f:
+                        f.write(cached)
+                    set_progress(progress_id, 100, "✅ Analysis complete! Download ready.", completed=True, file_path=permanent_path)
+                    log.debug("[%s] Served from result cache", progress_id)
+                    return jsonify({"status": "started", "progress_id": progress_id})
+
+            set_progress(progress_id, 0, "Initializing...")
+
+            job_executor.submit(process_files, progress_id, temp_template_path, temp_report_path, date_str, cache_key)
+            spooled_paths -= {temp_template_path, temp_report_path}
+            log.debug("[%s] Job queued.", progress_id)
 
             return jsonify({"status": "started", "progress_id": progress_id})
 
+        except HTTPException:
+            raise  # e.g. 413 from MAX_CONTENT_LENGTH; let the error handlers answer it
+
         except Exception as e:
-            print("FATAL ERROR in / route:", str(e))
+            log.exception("FATAL ERROR in / route: %s", e)
             return jsonify({"error": f"Unexpected server error: {str(e)}"}), 500
 
+        finally:
+            remove_files(*spooled_paths)
+
     return render_template("index_zip.html")
 
 @app.route("/progress/<progress_id>")
 def get_progress(progress_id):
-    data = progress_store.get(progress_id, {"percent": 0, "status": "Not started", "completed": False, "file_path": None})
+    data = get_progress_entry(progress_id, {"percent": 0, "status": "Not started", "completed": False, "file_path": None})
     return jsonify(data)
 
+@app.route("/progress-stream/<progress_id>")
+def stream_progress(progress_id):
+    """Server-sent events carrying the same entries as /progress, pushed as they change until the job completes."""
+    if not PROGRESS_STREAM_SLOTS.acquire(blocking=False):
+        return "Too many progress streams open, poll /progress instead", 503
+
+    def events():
+        last = None
+        last_sent = started = time.monotonic()
+        while True:
+            data = get_progress_entry(progress_id)
+            now = time.monotonic()
+            if data is None:
+                # Unknown or expired id: report it once like /progress does, then stop holding the thread
+                data = {"percent": 0, "status": "Not started", "completed": False, "file_path": None}
+                if data != last:
+                    yield f"data: {json.dumps(data)}\n\n"
+                    last, last_sent = data, now
+                if now - started >= PROGRESS_STREAM_UNKNOWN_GRACE:
+                    return
+            elif data != last:
+                yield f"data: {json.dumps(data)}\n\n"
+                last, last_sent = data, now
+                if data.get("completed"):
+                    return
+            elif now - last_sent >= PROGRESS_STREAM_KEEPALIVE:
+                yield ": keep-alive\n\n"
+                last_sent = now
+            if now - started >= PROGRESS_STREAM_MAX:
+                return
+            time.sleep(PROGRESS_STREAM_INTERVAL)
+
+    response = Response(events(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # Called when the server closes the response, also when the client went away before the stream started
+    response.call_on_close(PROGRESS_STREAM_SLOTS.release)
+    return response
+
 @app.route("/download/<progress_id>")
 def download_file(progress_id):
-    data = progress_store.get(progress_id, {})
+    data = get_progress_entry(progress_id, {})
     file_path = data.get("file_path")
 
     if file_path and os.path.exists(file_path):
-        return send_file(file_path, as_attachment=True, download_name="HPPD_Comparison_Output.xlsx")
+        if X_ACCEL_REDIRECT_PREFIX:
+            # Outputs are always written straight into UPLOAD_DIR (see output_path_for), so the name is enough
+            response = Response(mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            response.headers["Content-Disposition"] = 'attachment; filename="HPPD_Comparison_Output.xlsx"'
+            response.headers["X-Accel-Redirect"] = X_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + os.path.basename(file_path)
+            return response
+        return send_file(file_path, as_attachment=True, download_name="HPPD_Comparison_Output.xlsx", conditional=True)
     else:
         return "File not found", 404
 
@@ -147,4 +533,4 @@ def too_large(e):
     return "File is too large", 413
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -1,47 +1,134 @@
-import pandas as pd
+import numpy as np
 import openpyxl
 import xlrd
-from datetime import datetime
+from datetime import date, datetime, timedelta, timezone
 import os
 import re
-from difflib import get_close_matches
+import string
+import logging
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+from rapidfuzz import fuzz, process
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
-from openpyxl.styles import PatternFill, Font, Alignment, numbers
+from openpyxl.styles import PatternFill, Font, Alignment, NamedStyle, numbers
 import concurrent.futures
-from functools import lru_cache
+import multiprocessing
+import threading
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from functools import cached_property, lru_cache
+from openpyxl.utils.cell import coordinate_to_tuple
+from openpyxl.writer.excel import ExcelWriter
+from openpyxl.utils.datetime import from_excel, from_ISO8601, CALENDAR_MAC_1904, WINDOWS_EPOCH
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:  # Reports are read with xlrd alone when python-calamine isn't installed
+    CalamineWorkbook = None
+
+log = logging.getLogger(__name__)
+
+# Output styles, shared by every cell that uses them
+FONT_TITLE = Font(bold=True, size=20)
+FONT_HEADER = Font(bold=True, size=16)
+FONT_DATA = Font(size=14)
+FONT_DIFF = Font(size=14, italic=True)
+ALIGN_CENTER = Alignment(horizontal="center", vertical="center")
+FILL_PROJECTED = PatternFill("solid", fgColor="D1CFCF")
+FILL_ACTUAL = PatternFill("solid", fgColor="FFFFFF")
+FILL_DIFF_GOOD = PatternFill("solid", fgColor="C8E6C9")  # actual above projected
+FILL_DIFF_BAD = PatternFill("solid", fgColor="FFCDD2")
+FILL_DIFF_NEUTRAL = PatternFill("solid", fgColor="FFFACD")  # no numeric difference
+RED_GREEN_COLS = frozenset((
+    "Total HPPD", "CNA HPPD", "RN+LPN HPPD",
+    "CNA Agency %", "RN+LPN Agency %", "Total Agency %"
+))
+# Named styles of the comparison rows, (name, font, fill); each also gets a "<name> Date" variant
+ROW_STYLES = (
+    ("HPPD Projected", FONT_DATA, FILL_PROJECTED),
+    ("HPPD Actual", FONT_DATA, FILL_ACTUAL),
+    ("HPPD Difference", FONT_DIFF, FILL_ACTUAL),
+    ("HPPD Difference Good", FONT_DIFF, FILL_DIFF_GOOD),
+    ("HPPD Difference Bad", FONT_DIFF, FILL_DIFF_BAD),
+    ("HPPD Difference Neutral", FONT_DIFF, FILL_DIFF_NEUTRAL),
+)
+COLUMN_HEADERS = (
+    "Facility", "Type", "Total HPPD", "CNA HPPD", "RN+LPN HPPD",
+    "CNA Agency %", "RN+LPN Agency %", "Total Agency %",
+    "Notes", "Date"
+)
+DIFF_COLS = tuple(c for c in COLUMN_HEADERS if c not in ("Facility", "Type", "Date"))  # Columns the Difference row subtracts
+# Comparison rows are tuples in COLUMN_HEADERS order; DIFF_COLS are contiguous in it
+COLUMN_INDEX = {name: i for i, name in enumerate(COLUMN_HEADERS)}
+DIFF_SLICE = slice(COLUMN_INDEX[DIFF_COLS[0]], COLUMN_INDEX[DIFF_COLS[-1]] + 1)
+COLUMN_LETTERS = tuple(get_column_letter(i) for i in range(1, len(COLUMN_HEADERS) + 1))
+# Named style of each column's cells by row type; None where a Difference cell is colored by its value
+COLUMN_STYLES = {
+    row_type: tuple(
+        None if row_type == "Difference" and col_name in RED_GREEN_COLS
+        else f"{style} Date" if col_name == "Date" else style
+        for col_name in COLUMN_HEADERS
+    )
+    for row_type, style in (("Projected", "HPPD Projected"), ("Actual", "HPPD Actual"), ("Difference", "HPPD Difference"))
+}
+
+_RX_NONALNUM = re.compile(r"[^a-z0-9\s]")
+_RX_WS = re.compile(r"\s+")
+
+# Results of normalize_name/extract_core_from_report by input name; emptied at the start of each run (see clear_name_caches)
+_normalize_cache = {}
+_core_cache = {}
+
+def clear_name_caches():
+    _normalize_cache.clear()
+    _core_cache.clear()
 
 def normalize_name(name):
+    cleaned = _normalize_cache.get(name)
+    if cleaned is None:
+        cleaned = _normalize_cache[name] = _normalize_name(name)
+    return cleaned
+
+def _normalize_name(name):
     if not name:
         return ""
     name = str(name).lower()
-    name = re.sub(r"[^a-z0-9\s]", "", name)
-    name = re.sub(r"\s+", " ", name).strip()
+    name = _RX_NONALNUM.sub("", name)
+    name = _RX_WS.sub(" ", name).strip()
     return name
 
-@lru_cache(maxsize=1000)
 def extract_core_from_report(report_name):
-    print(f"        EXTRACT DEBUG: Input='{report_name}'")
+    core = _core_cache.get(report_name)
+    if core is None:
+        core = _core_cache[report_name] = _extract_core_from_report(report_name)
+    return core
+
+def _extract_core_from_report(report_name):
+    log.debug("EXTRACT DEBUG: Input='%s'", report_name)
     
     if not report_name:
-        print(f"        EXTRACT DEBUG: Empty input, returning ''")
+        log.debug("EXTRACT DEBUG: Empty input, returning ''")
         return ""
     
     report_name = str(report_name).lower()
-    print(f"        EXTRACT DEBUG: After lowercase='{report_name}'")
+    log.debug("EXTRACT DEBUG: After lowercase='%s'", report_name)
 
     # Remove prefix like "Total Nursing Wrkd - " if present
     if report_name.startswith("total nursing wrkd - "):
         core = report_name[21:].strip()
-        print(f"        EXTRACT DEBUG: After prefix removal='{core}'")
+        log.debug("EXTRACT DEBUG: After prefix removal='%s'", core)
     else:
         core = report_name.strip()
-        print(f"        EXTRACT DEBUG: No prefix to remove, core='{core}'")
+        log.debug("EXTRACT DEBUG: No prefix to remove, core='%s'", core)
 
     # Normalize
-    core = re.sub(r"[^a-z0-9\s]", "", core)
-    core = re.sub(r"\s+", " ", core).strip()
-    print(f"        EXTRACT DEBUG: After normalization='{core}'")
+    core = _RX_NONALNUM.sub("", core)
+    core = _RX_WS.sub(" ", core).strip()
+    log.debug("EXTRACT DEBUG: After normalization='%s'", core)
 
     # Apply overrides
     overrides = {
@@ -55,53 +142,100 @@ def extract_core_from_report(report_name):
     original_core = core
     core = overrides.get(core, core)
     if core != original_core:
-        print(f"        EXTRACT DEBUG: Override applied: '{original_core}' → '{core}'")
+        log.debug("EXTRACT DEBUG: Override applied: '%s' → '%s'", original_core, core)
     else:
-        print(f"        EXTRACT DEBUG: No override, final='{core}'")
+        log.debug("EXTRACT DEBUG: No override, final='%s'", core)
     
     return core
 
 def build_template_name_map(template_entries):
-    return {entry["cleaned_name"]: entry["facility"] for entry in template_entries}
+    return {entry.cleaned_name: entry.facility for entry in template_entries}
+
+def build_template_names(template_name_map):
+    """The map as two parallel tuples, (cleaned names, facility names), for the fuzzy matcher to index into"""
+    return tuple(template_name_map), tuple(template_name_map.values())
+
+def score_template_names(core_names, cleaned_names):
+    """Similarity (0-100) of each core name to each cleaned template name, in one rapidfuzz cdist call.
+
+    Names are already normalized, so rapidfuzz compares them as they are. fuzz.ratio is 2*LCS/(total length),
+    which is never below difflib's ratio for the same pair, so it can rule names out but not pick the match."""
+    return process.cdist(core_names, cleaned_names, scorer=fuzz.ratio, processor=None, dtype=np.float64, workers=-1)
+
+def closest_template_index(core_name, cleaned_names, scores, cutoff):
+    """Index of the name difflib.get_close_matches(core_name, cleaned_names, n=1, cutoff=cutoff) picks, or None.
+
+    scores (this core name's row of score_template_names) narrows the search to the names that can
+    still reach the cutoff; difflib's ratio decides among them, so only those few get a SequenceMatcher pass."""
+    # Slack so float rounding in either ratio can't drop a name difflib would accept
+    candidates = np.flatnonzero(scores >= cutoff * 100 - 1e-6)
+    matcher = SequenceMatcher()
+    matcher.set_seq2(core_name)  # Same argument order as get_close_matches, whose ratio isn't symmetric
+    best = best_index = None
+    for i in candidates:
+        matcher.set_seq1(cleaned_names[i])
+        ratio = matcher.ratio()
+        # Ties go to the larger name, as with get_close_matches
+        if ratio >= cutoff and (best is None or (ratio, cleaned_names[i]) > best):
+            best, best_index = (ratio, cleaned_names[i]), int(i)
+    return best_index
+
+def match_reports_to_templates(report_names, cleaned_names, facilities, exact_map, cutoff=0.6):
+    """match_report_to_template for a batch of reports.
+
+    Every distinct core name without an exact match is scored against all template
+    names in a single cdist call, rather than a fuzzy search per report and cutoff."""
+    cores = [extract_core_from_report(name) for name in report_names]
+    fuzzy_cores = list(dict.fromkeys(core for core in cores if core not in exact_map))
+    scores = dict(zip(fuzzy_cores, score_template_names(fuzzy_cores, cleaned_names))) if fuzzy_cores else {}
+    return [
+        match_report_to_template(name, cleaned_names, facilities, exact_map, cutoff, scores.get(core))
+        for name, core in zip(report_names, cores)
+    ]
 
-def match_report_to_template(report_name, template_name_map, cutoff=0.6):
-    print(f"\n🔍 MATCHING DEBUG: '{report_name}'")
+def match_report_to_template(report_name, cleaned_names, facilities, exact_map, cutoff=0.6, scores=None):
+    """cleaned_names/facilities (see build_template_names) and exact_map (cleaned name -> facility)
+    are built once per run by the caller; so may scores (this report's row of score_template_names),
+    which is otherwise worked out here."""
+    log.debug("🔍 MATCHING DEBUG: '%s'", report_name)
     
     # Step 1: Extract core name
     core_name = extract_core_from_report(report_name)
-    print(f"    Step 1 - Extracted core: '{core_name}'")
+    log.debug("Step 1 - Extracted core: '%s'", core_name)
     
     # Show what's available in template map
-    template_keys = list(template_name_map.keys())
-    print(f"    Available template keys: {template_keys}")
+    log.debug("Available template keys: %s", cleaned_names)
 
     # Step 2: Try exact match
-    if core_name in template_name_map:
-        result = template_name_map[core_name]
-        print(f"    Step 2 - ✅ EXACT MATCH: '{core_name}' → '{result}'")
+    if core_name in exact_map:
+        result = exact_map[core_name]
+        log.debug("Step 2 - ✅ EXACT MATCH: '%s' → '%s'", core_name, result)
         return result
     else:
-        print(f"    Step 2 - ❌ No exact match for '{core_name}'")
+        log.debug("Step 2 - ❌ No exact match for '%s'", core_name)
+
+    if scores is None:
+        scores = score_template_names([core_name], cleaned_names)[0]
 
     # Step 3: Try fuzzy match with high cutoff
-    match = get_close_matches(core_name, template_keys, n=1, cutoff=cutoff)
-    if match:
-        result = template_name_map[match[0]]
-        print(f"    Step 3 - ✅ FUZZY MATCH (cutoff={cutoff}): '{core_name}' → '{match[0]}' → '{result}'")
+    match = closest_template_index(core_name, cleaned_names, scores, cutoff)
+    if match is not None:
+        result = facilities[match]
+        log.debug("Step 3 - ✅ FUZZY MATCH (cutoff=%s): '%s' → '%s' → '%s'", cutoff, core_name, cleaned_names[match], result)
         return result
     else:
-        print(f"    Step 3 - ❌ No fuzzy match at cutoff {cutoff}")
+        log.debug("Step 3 - ❌ No fuzzy match at cutoff %s", cutoff)
 
     # Step 4: Try low-confidence match as fallback
-    match = get_close_matches(core_name, template_keys, n=1, cutoff=0.3)
-    if match:
-        result = template_name_map[match[0]]
-        print(f"    Step 4 - ✅ LOW-CONFIDENCE MATCH (cutoff=0.3): '{core_name}' → '{match[0]}' → '{result}'")
+    match = closest_template_index(core_name, cleaned_names, scores, 0.3)
+    if match is not None:
+        result = facilities[match]
+        log.debug("Step 4 - ✅ LOW-CONFIDENCE MATCH (cutoff=0.3): '%s' → '%s' → '%s'", core_name, cleaned_names[match], result)
         return result
     else:
-        print(f"    Step 4 - ❌ No match even at cutoff 0.3")
+        log.debug("Step 4 - ❌ No match even at cutoff 0.3")
 
-    print(f"    FINAL RESULT: ❌ NO MATCH FOUND")
+    log.debug("FINAL RESULT: ❌ NO MATCH FOUND")
     return None
 
 def safe_float_conversion(value, default=0.0):
@@ -113,29 +247,204 @@ def safe_float_conversion(value, default=0.0):
     except (ValueError, TypeError):
         return default
 
-def safe_cell_value(ws, cell_ref):
-    """Safely get cell value"""
+# Template cells read by process_template_file
+TEMPLATE_CELLS = ("D3", "E62", "B11", "E27", "G58", "E58", "F58", "L37", "L34", "O34")
+
+_NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_NS_DOC_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+def _text_content(node):
+    """Plain text of a shared or inline string element, as openpyxl's Text.content gives it"""
+    plain = node.find(_NS_MAIN + "t")
+    parts = [plain.text or ""] if plain is not None else []
+    parts.extend(run.findtext(_NS_MAIN + "t") or "" for run in node.findall(_NS_MAIN + "r"))
+    return "".join(parts)
+
+def _read_shared_strings(archive, last_index):
+    """Shared strings up to last_index, stopping there instead of reading the whole table"""
+    strings = []
+    with archive.open("xl/sharedStrings.xml") as f:
+        for _, node in ET.iterparse(f):
+            if node.tag == _NS_MAIN + "si":
+                strings.append(_text_content(node).replace("x005F_", ""))
+                node.clear()
+                if len(strings) > last_index:
+                    break
+    return strings
+
+def _date_style_ids(archive):
+    """Indexes of the cell styles that format numbers as dates and as timedeltas, as openpyxl works them out"""
     try:
-        return ws[cell_ref].value
-    except:
-        return None
+        styles = ET.fromstring(archive.read("xl/styles.xml"))
+    except KeyError:
+        return set(), set()
+    num_fmts = styles.find(_NS_MAIN + "numFmts")
+    custom = {int(n.get("numFmtId")): n.get("formatCode") for n in (num_fmts if num_fmts is not None else ())}
+    cell_xfs = styles.find(_NS_MAIN + "cellXfs")
+    date_ids, timedelta_ids = set(), set()
+    for idx, xf in enumerate(cell_xfs if cell_xfs is not None else ()):
+        fmt_id = int(xf.get("numFmtId", 0))
+        fmt = custom[fmt_id] if fmt_id in custom else builtin_format_code(fmt_id)
+        if is_date_format(fmt):
+            date_ids.add(idx)
+        if is_timedelta_format(fmt):
+            timedelta_ids.add(idx)
+    return date_ids, timedelta_ids
+
+def _decode_cells(archive, raw, shared, date_ids, timedelta_ids, date1904):
+    """Turn the (type, raw value, style id) of each cell into the value openpyxl would give.
+
+    shared holds the shared strings read so far and is topped up from the archive when a cell needs a later one."""
+    shared_ids = [int(value) for data_type, value, _ in raw.values() if data_type == "s" and value is not None]
+    if shared_ids and max(shared_ids) >= len(shared):
+        shared[:] = _read_shared_strings(archive, max(shared_ids))
+
+    values = {}
+    for ref, (data_type, value, style_id) in raw.items():
+        if value is None or data_type in ("inlineStr", "str", "e"):
+            pass
+        elif data_type == "n":
+            value = float(value) if "." in value or "E" in value or "e" in value else int(value)
+            if style_id in date_ids:
+                try:
+                    value = from_excel(value, CALENDAR_MAC_1904 if date1904 else WINDOWS_EPOCH,
+                                       timedelta=style_id in timedelta_ids)
+                except (OverflowError, ValueError):
+                    value = "#VALUE!"
+        elif data_type == "s":
+            value = shared[int(value)]
+        elif data_type == "b":
+            value = bool(int(value))
+        elif data_type == "d":
+            value = from_ISO8601(value)
+        values[ref] = value
+    return values
+
+def read_template_cells(filepath, sheet_name, cells=TEMPLATE_CELLS, stop_if=None):
+    """
+    Read the cached values of a few cells on one sheet straight from the xlsx XML.
 
-def safe_xlrd_cell_value(ws, row, col):
-    """Safely get cell value from xlrd worksheet"""
-    try:
-        if ws.nrows > row and ws.ncols > col:
-            return ws.cell_value(row, col)
-        return None
-    except:
-        return None
+    Gives the values openpyxl.load_workbook(data_only=True) would, without building a
+    workbook, and stops parsing the sheet after the last row that holds one of the cells.
+
+    stop_if is an optional (cell reference, predicate) pair: once parsing is past that
+    cell's row, the predicate is called with its value and, if it returns True, parsing
+    stops there and the cells further down come back as None.
+
+    Returns:
+        dict mapping each cell reference to its value, or None if there is no sheet named sheet_name.
+        Raises on anything it doesn't handle (e.g. cells without references) so callers can fall back to openpyxl.
+    """
+    wanted = set(cells)
+    last_row = max(coordinate_to_tuple(ref)[0] for ref in cells)
+    stop_ref, stop = stop_if or (None, None)
+    stop_row = coordinate_to_tuple(stop_ref)[0] if stop_if else None
+
+    with zipfile.ZipFile(filepath) as archive:
+        workbook = ET.fromstring(archive.read("xl/workbook.xml"))
+        sheet = next((s for s in workbook.iter(_NS_MAIN + "sheet") if s.get("name") == sheet_name), None)
+        if sheet is None:
+            return None
+        rels = ET.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+        target = next(rel.get("Target") for rel in rels if rel.get("Id") == sheet.get(_NS_DOC_REL + "id"))
+        sheet_part = target[1:] if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+        workbook_pr = workbook.find(_NS_MAIN + "workbookPr")
+        date1904 = workbook_pr is not None and workbook_pr.get("date1904") in ("1", "true")
+        date_ids, timedelta_ids = _date_style_ids(archive)
+        shared = []
+
+        # (type, raw value, style id) per wanted cell; inline strings are decoded while their element is still there
+        raw = {}
+        with archive.open(sheet_part) as f:
+            for event, node in ET.iterparse(f, events=("start", "end")):
+                if event == "start":
+                    if node.tag == _NS_MAIN + "row":
+                        row = int(node.get("r"))
+                        if row > last_row:
+                            break
+                        if stop_row is not None and row > stop_row:
+                            checked = {stop_ref: raw[stop_ref]} if stop_ref in raw else {}
+                            if stop(_decode_cells(archive, checked, shared, date_ids, timedelta_ids, date1904).get(stop_ref)):
+                                raw = checked
+                                break
+                            stop_row = None
+                elif node.tag == _NS_MAIN + "c":
+                    ref = node.get("r")
+                    if ref is None:
+                        raise ValueError("cell without a reference")
+                    if ref in wanted:
+                        data_type = node.get("t", "n")
+                        if data_type == "inlineStr":
+                            inline = node.find(_NS_MAIN + "is")
+                            value = _text_content(inline) if inline is not None else None
+                        else:
+                            value = node.findtext(_NS_MAIN + "v") or None
+                        raw[ref] = (data_type, value, int(node.get("s", 0)))
+                elif node.tag == _NS_MAIN + "row":
+                    node.clear()
+
+        values = _decode_cells(archive, raw, shared, date_ids, timedelta_ids, date1904)
+    return {ref: values.get(ref) for ref in cells}
+
+def read_sheet_cells(ws, cells=TEMPLATE_CELLS, stop_if=None):
+    """Values of a few cells of an openpyxl worksheet, read in a single iter_rows pass.
+
+    In read_only mode every ws["D3"] lookup scans the sheet XML again from the top,
+    so the fallback reads the block that spans the wanted cells row by row once.
+    stop_if works as for read_template_cells."""
+    wanted = {}
+    for ref in cells:
+        row, col = coordinate_to_tuple(ref)
+        wanted.setdefault(row, []).append((col, ref))
+    max_col = max(col for refs in wanted.values() for col, _ in refs)
+    stop_ref, stop = stop_if or (None, None)
+    stop_row = coordinate_to_tuple(stop_ref)[0] if stop_if else None
+
+    values = dict.fromkeys(cells)
+    rows = ws.iter_rows(min_row=min(wanted), max_row=max(wanted), max_col=max_col, values_only=True)
+    for row, row_values in enumerate(rows, start=min(wanted)):
+        if stop_row is not None and row > stop_row:
+            if stop(values.get(stop_ref)):
+                return {ref: values[ref] if ref == stop_ref else None for ref in cells}
+            stop_row = None
+        for col, ref in wanted.get(row, ()):
+            if col <= len(row_values):
+                values[ref] = row_values[col - 1]
+    return values
+
+def iter_input_files(source):
+    """Yield (filepath, filename) for every file under a folder.
+
+    source may also be an iterable of (filepath, filename) pairs, e.g. files
+    still being extracted from an upload; it is passed through lazily.
+    Folders are walked with os.scandir, whose cached entry types avoid a
+    stat() per file; like os.walk, a folder's files come before its subfolders."""
+    if not isinstance(source, (str, os.PathLike)):
+        yield from source
+        return
+
+    pending = [os.fspath(source)]
+    while pending:
+        subdirs = []
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        if not entry.is_symlink():  # os.walk doesn't follow folder links either
+                            subdirs.append(entry.path)
+                    else:
+                        yield entry.path, entry.name
+        except OSError:
+            continue
+        pending.extend(reversed(subdirs))
 
 def is_valid_file(filename, extension):
-    """Check if file is valid (not a Mac OS hidden file or corrupt)"""
+    """Check if file is valid (not a Mac OS hidden file or corrupt).
+
+    extension is lowercase; the name is only lowercased when it doesn't already end with it as is."""
     if filename.startswith('._'):
         return False
-    if not filename.lower().endswith(extension):
-        return False
-    return True
+    return filename.endswith(extension) or filename.lower().endswith(extension)
 
 def extract_agency_cna_rnlpn_from_sheet2(ws2):
     """
@@ -155,61 +464,52 @@ def extract_agency_cna_rnlpn_from_sheet2(ws2):
     agency_rnlpn_hours = 0.0
     
     current_block_type = None  # 'agency_cna', 'agency_rn', 'agency_lpn', or None
-    
-    # Start scanning from row 11 (index 10) downward
-    for row_idx in range(10, ws2.nrows):
-        try:
-            # Get value from column A (index 0)
-            cell_value = ws2.cell_value(row_idx, 0)
-            
-            # Skip empty cells
-            if not cell_value or str(cell_value).strip() == "":
-                continue
-                
-            cell_str = str(cell_value).strip().upper()
-            
-            # Check if this is a header row (contains forward slashes)
-            if '/' in cell_str:
-                # Reset current block type
-                current_block_type = None
-                
-                # Parse the header pattern: e.g., "806/AGY/.../CNA"
-                parts = cell_str.split('/')
-                
-                # Check if this is an agency block (contains 'AGY')
-                is_agency = any('AGY' in part for part in parts)
-                
-                if is_agency and len(parts) > 0:
-                    # Get the last part to determine staff type
-                    last_part = parts[-1].strip()
-                    
-                    if 'CNA' in last_part:
-                        current_block_type = 'agency_cna'
-                    elif 'RN' in last_part:
-                        current_block_type = 'agency_rn'
-                    elif 'LPN' in last_part:
-                        current_block_type = 'agency_lpn'
-            
-            else:
-                # This is a data row - extract hours from column M (index 12)
-                if current_block_type and ws2.ncols > 12:  # Make sure column M exists
-                    try:
-                        hours_value = ws2.cell_value(row_idx, 12)  # Column M
-                        hours = safe_float_conversion(hours_value)
-                        
-                        if current_block_type == 'agency_cna':
-                            agency_cna_hours += hours
-                        elif current_block_type in ['agency_rn', 'agency_lpn']:
-                            agency_rnlpn_hours += hours
-                            
-                    except (ValueError, TypeError):
-                        # Skip rows with invalid hour values
-                        continue
-                        
-        except Exception:
-            # Skip problematic rows
+
+    # Scan columns A and M from row 11 (index 10) downward, each read in one go
+    labels = ws2.col_values(0, 10)
+    hours_col = ws2.col_values(12, 10) if ws2.ncols > 12 else [None] * len(labels)  # Column M, if it exists
+    for cell_value, hours_value in zip(labels, hours_col):
+        # Skip empty cells
+        if not cell_value:
             continue
-    
+
+        # Numbers (most rows) can't be headers - straight to the data row branch
+        if isinstance(cell_value, (int, float)):
+            cell_str = None
+        else:
+            cell_str = str(cell_value).strip().upper()
+            if not cell_str:
+                continue
+
+        # Check if this is a header row (contains forward slashes)
+        if cell_str and '/' in cell_str:
+            # Reset current block type
+            current_block_type = None
+
+            # Parse the header pattern: e.g., "806/AGY/.../CNA"
+            parts = cell_str.split('/')
+
+            # Check if this is an agency block (contains 'AGY')
+            if 'AGY' in cell_str:
+                # Get the last part to determine staff type
+                last_part = parts[-1].strip()
+
+                if 'CNA' in last_part:
+                    current_block_type = 'agency_cna'
+                elif 'RN' in last_part:
+                    current_block_type = 'agency_rn'
+                elif 'LPN' in last_part:
+                    current_block_type = 'agency_lpn'
+
+        elif current_block_type and hours_value is not None:
+            # This is a data row - hours are in column M
+            hours = safe_float_conversion(hours_value)
+
+            if current_block_type == 'agency_cna':
+                agency_cna_hours += hours
+            else:  # 'agency_rn' or 'agency_lpn'
+                agency_rnlpn_hours += hours
+
     return {
         'agency_cna_hours': agency_cna_hours,
         'agency_rnlpn_hours': agency_rnlpn_hours,
@@ -251,9 +551,9 @@ def compute_agency_percentages(agency_data, actual_cna_hours, actual_rn_hours, a
     actual_agency_total_pct = (agency_total_hours / actual_total_hours * 100) if actual_total_hours > 0 else 0.0
     
     return {
-        'actual_agency_cna_pct': round(actual_agency_cna_pct, 2),
-        'actual_agency_nurse_pct': round(actual_agency_nurse_pct, 2),
-        'actual_agency_total_pct': round(actual_agency_total_pct, 2),
+        'actual_agency_cna_pct': actual_agency_cna_pct,
+        'actual_agency_nurse_pct': actual_agency_nurse_pct,
+        'actual_agency_total_pct': actual_agency_total_pct,
         'actual_cna_hours': actual_cna_hours,
         'actual_rn_hours': actual_rn_hours,
         'actual_lpn_hours': actual_lpn_hours
@@ -264,29 +564,28 @@ def extract_hours_by_dept_code(ws3):
     """Extract hours from column H by scanning department codes in column C, starting from row 10."""
     rn_hours = lpn_hours = cna_hours = total_hours = 0.0
 
-    for row in range(9, ws3.nrows):  # Start from row 10 (index 9)
-        try:
-            code_cell = ws3.cell_value(row, 2)  # Column C (index 2)
-            if not code_cell:
-                continue
+    if ws3.ncols <= 7:  # No column H, so no hours
+        return rn_hours, lpn_hours, cna_hours, total_hours
 
-            code = str(code_cell).strip()
-            hours = safe_float_conversion(ws3.cell_value(row, 7))  # Column H (index 7)
+    # Columns C (index 2) and H (index 7) from row 10 (index 9), each fetched in one call
+    for code_cell, hours_cell in zip(ws3.col_values(2, 9), ws3.col_values(7, 9)):
+        if not code_cell:
+            continue
 
-            if code == "3210":       # RN
-                rn_hours = hours
-            elif code == "3215":     # LPN
-                lpn_hours = hours
-            elif code == "3225":     # CNA
-                cna_hours = hours
+        code = str(code_cell).strip()
+        hours = safe_float_conversion(hours_cell)
 
-            # Look for total row
-            label = str(code_cell).lower()
-            if "total hours worked" in label or "grand total" in label:
-                total_hours = safe_float_conversion(ws3.cell_value(row, 7))
+        if code == "3210":       # RN
+            rn_hours = hours
+        elif code == "3215":     # LPN
+            lpn_hours = hours
+        elif code == "3225":     # CNA
+            cna_hours = hours
 
-        except Exception:
-            continue
+        # Look for total row
+        label = str(code_cell).lower()
+        if "total hours worked" in label or "grand total" in label:
+            total_hours = hours
 
     if total_hours == 0:
         total_hours = rn_hours + lpn_hours + cna_hours
@@ -294,9 +593,66 @@ def extract_hours_by_dept_code(ws3):
     return rn_hours, lpn_hours, cna_hours, total_hours
 
 
+@dataclass(slots=True)
+class TemplateEntry:
+    """Projected figures read from one template sheet"""
+    facility: str
+    cleaned_name: str
+    date: date
+    note: str
+    census: float
+    proj_total: float
+    proj_cna: float
+    proj_nurse: float
+    proj_agency_total: float
+    proj_agency_cna: float
+    proj_agency_nurse: float
+
+# (substring of the normalized D3 name, facility name to use instead); the first match wins
+TEMPLATE_FACILITY_OVERRIDES = (
+    ("sunbury skilled nursing and rehabilitation", "sunbury"),
+    ("lebanon skilled nursing and rehabilitation", "lebanon"),
+    ("chambersburg skilled nursing and rehabilitation", "chambersburg"),
+    ("pottstown skilled nursing and rehabilitation", "pottstown"),
+    # NOTE: Do NOT add back abbeyville, inners creek, or montgomery mappings
+)
+
+EXCEL_EPOCH = datetime(1899, 12, 30)
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%d/%m/%Y")  # Tried in order after ISO, so 01/02/2025 is January 2nd
+DATE_ERRORS = (ValueError, TypeError, OverflowError)  # What coerce_date raises for values that aren't dates
+
+def coerce_date(value):
+    """A cell value as a date: datetimes and dates as they are, numbers as Excel serial dates, strings
+    as ISO dates/datetimes, in one of DATE_FORMATS, or else whatever pandas can parse ("1/5/25",
+    "Jan 5, 2025", "2025/01/05"). Raises one of DATE_ERRORS if the value isn't a date."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (EXCEL_EPOCH + timedelta(days=int(value))).date()
+    if not isinstance(value, str):
+        raise TypeError(f"not a date: {value!r}")
+    text = value.strip()
+    try:
+        return datetime.fromisoformat(text).date()
+    except ValueError:
+        pass
+    day_part = text.split(" ", 1)[0]  # "01/05/2025 00:00:00" → "01/05/2025"
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(day_part, fmt).date()
+        except ValueError:
+            pass
+    import pandas as pd  # Only for strings the formats above miss; kept out of the parse workers' startup otherwise
+    parsed = pd.to_datetime(text)
+    if parsed is pd.NaT:  # e.g. "NaT" - not a date to compare
+        raise ValueError(f"not a date: {value!r}")
+    return parsed.date()
+
 def process_template_file(args):
-    """Process a single template file - for parallel processing"""
-    filepath, filename, target_date = args
+    """Process a single template file - for parallel processing; target_day is the date to compare, already parsed"""
+    filepath, filename, target_day = args
     
     if not is_valid_file(filename, ".xlsx"):
         if filename.startswith('._'):
@@ -304,65 +660,69 @@ def process_template_file(args):
         else:
             return None, (filename, "Not .xlsx, skipped")
     
-    try:
-        # Use read_only=True for speed and memory efficiency
-        wb = openpyxl.load_workbook(filepath, data_only=True, read_only=True)
-    except Exception as e:
-        return None, (filename, f"Openpyxl error: {str(e)[:100]}")
+    def unusable_date(date_cell):
+        """True when B11 already rules the sheet out, so the rows below it aren't read"""
+        if not date_cell:
+            return True
+        try:
+            return target_day is not None and coerce_date(date_cell) != target_day
+        except DATE_ERRORS:
+            return True
 
     try:
-        sheet_day = str(datetime.strptime(target_date, "%Y-%m-%d").day)
-        if sheet_day not in wb.sheetnames:
-            wb.close()
-            return None, (filename, f"No sheet named '{sheet_day}'")
-            
-        ws = wb[sheet_day]
-
-        # Batch read all needed cells at once
-        cell_values = {}
-        cells_to_read = ["D3", "E62", "B11", "E27", "G58", "E58", "F58", "L37", "L34", "O34"]
-        for cell_ref in cells_to_read:
-            cell_values[cell_ref] = safe_cell_value(ws, cell_ref)
+        sheet_day = str(target_day.day)
+        cell_values = read_template_cells(filepath, sheet_day, stop_if=("B11", unusable_date))
+    except Exception:
+        # Anything the direct XML read can't handle goes through openpyxl, which also words the errors for broken files
+        try:
+            # Use read_only=True for speed and memory efficiency; external link caches are never looked at
+            wb = openpyxl.load_workbook(filepath, data_only=True, read_only=True, keep_links=False)
+        except Exception as e:
+            return None, (filename, f"Openpyxl error: {str(e)[:100]}")
 
-        facility_full = cell_values["D3"]
-        if not facility_full:
+        try:
+            sheet_day = str(target_day.day)
+            if sheet_day in wb.sheetnames:
+                ws = wb[sheet_day]
+                cell_values = read_sheet_cells(ws, stop_if=("B11", unusable_date))
+            else:
+                cell_values = None
+        except Exception as e:
+            return None, (filename, f"Data parsing error: {str(e)[:100]}")
+        finally:
             wb.close()
-            return None, (filename, "Missing facility name in D3")
-            
-        cleaned_facility = normalize_name(facility_full)
 
-        # Add back the necessary mappings (but NOT the conflicting ones)
-        if "sunbury skilled nursing and rehabilitation" in cleaned_facility:
-            cleaned_facility = "sunbury" 
-        elif "lebanon skilled nursing and rehabilitation" in cleaned_facility:
-            cleaned_facility = "lebanon"
-        elif "chambersburg skilled nursing and rehabilitation" in cleaned_facility:
-            cleaned_facility = "chambersburg"
-        elif "pottstown skilled nursing and rehabilitation" in cleaned_facility:
-            cleaned_facility = "pottstown"
-        # NOTE: Do NOT add back abbeyville, inners creek, or montgomery mappings
+    if cell_values is None:
+        return None, (filename, f"No sheet named '{sheet_day}'")
 
+    try:
+        # The date comes first: a sheet for another day is rejected before anything else on it is looked at
         date_cell = cell_values["B11"]
         if not date_cell:
-            wb.close()
             return None, (filename, "Missing date in B11")
 
         try:
-            if isinstance(date_cell, datetime):
-                sheet_date = date_cell.date()
-            else:
-                sheet_date = pd.to_datetime(date_cell).date()
-        except:
-            wb.close()
+            sheet_date = coerce_date(date_cell)
+        except DATE_ERRORS:
             return None, (filename, "Invalid date format in B11")
         
-        if target_date and sheet_date != datetime.strptime(target_date, "%Y-%m-%d").date():
-            wb.close()
-            return None, (filename, f"Date mismatch: sheet has {sheet_date}, looking for {target_date}")
+        if target_day and sheet_date != target_day:
+            return None, (filename, f"Date mismatch: sheet has {sheet_date}, looking for {target_day}")
+
+        facility_full = cell_values["D3"]
+        if not facility_full:
+            return None, (filename, "Missing facility name in D3")
+            
+        cleaned_facility = normalize_name(facility_full)
+
+        # Add back the necessary mappings (but NOT the conflicting ones)
+        for full_name, short_name in TEMPLATE_FACILITY_OVERRIDES:
+            if full_name in cleaned_facility:
+                cleaned_facility = short_name
+                break
 
         census = safe_float_conversion(cell_values["E27"])
         if census <= 0:
-            wb.close()
             return None, (filename, f"Invalid census value: {census} (census must be > 0)")
 
         # Calculate all values at once
@@ -378,57 +738,120 @@ def process_template_file(args):
         proj_agency_nurse = safe_float_conversion(cell_values["L34"]) * 100
         proj_agency_cna = safe_float_conversion(cell_values["O34"]) * 100
 
-        template_entry = {
-            "facility": str(facility_full),
-            "cleaned_name": cleaned_facility,
-            "date": sheet_date,
-            "note": str(cell_values["E62"]) if cell_values["E62"] else "",
-            "census": census,
-            "proj_total": projected_total_hppd,
-            "proj_cna": projected_cna_hppd,
-            "proj_nurse": projected_nurse_hppd,
-            "proj_agency_total": proj_agency_total,
-            "proj_agency_cna": proj_agency_cna,
-            "proj_agency_nurse": proj_agency_nurse
-        }
+        template_entry = TemplateEntry(
+            facility=str(facility_full),
+            cleaned_name=cleaned_facility,
+            date=sheet_date,
+            note=str(cell_values["E62"]) if cell_values["E62"] else "",
+            census=census,
+            proj_total=projected_total_hppd,
+            proj_cna=projected_cna_hppd,
+            proj_nurse=projected_nurse_hppd,
+            proj_agency_total=proj_agency_total,
+            proj_agency_cna=proj_agency_cna,
+            proj_agency_nurse=proj_agency_nurse
+        )
         
-        wb.close()
         return template_entry, None
         
     except Exception as e:
-        try:
-            wb.close()
-        except:
-            pass
         return None, (filename, f"Data parsing error: {str(e)[:100]}")
 
 
+def _as_xlrd_value(value):
+    """A calamine cell value as xlrd gives it: every number is a float (calamine returns whole ones as int)"""
+    return float(value) if type(value) is int else value
+
+class CalamineSheet:
+    """The part of the xlrd Sheet interface the report parsing uses, over rows read by python-calamine"""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self.nrows = len(rows)
+        self.ncols = max(map(len, rows), default=0)
+
+    def cell_value(self, rowx, colx):
+        return _as_xlrd_value(self._rows[rowx][colx])
+
+    def col_values(self, colx, start_rowx=0, end_rowx=None):
+        return [_as_xlrd_value(row[colx]) for row in self._rows[start_rowx:end_rowx]]
+
+class CalamineBook:
+    """The part of the xlrd Book interface the report parsing uses, over a python-calamine workbook.
+
+    calamine parses BIFF in Rust and hands date cells back as datetimes, so the
+    float-to-xldate conversion (and with it datemode) only applies to unformatted numbers."""
+
+    def __init__(self, filepath):
+        self._filepath = filepath
+        self._wb = CalamineWorkbook.from_path(filepath)
+
+    @cached_property
+    def datemode(self):
+        # calamine doesn't expose the book's 1904 flag; xlrd reads it from the workbook globals alone (on_demand
+        # loads no sheets), and only for a report whose date is an unformatted number
+        with xlrd.open_workbook(self._filepath, on_demand=True) as book:
+            return book.datemode
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wb.close()
+
+    def sheet_names(self):
+        return self._wb.sheet_names
+
+    def sheet_by_name(self, name):
+        # skip_empty_area=False keeps row and column indexes the same as xlrd's
+        return CalamineSheet(self._wb.get_sheet_by_name(name).to_python(skip_empty_area=False))
+
+    def unload_sheet(self, name):
+        pass  # Nothing is cached; each CalamineSheet is dropped once the caller is done with it
+
+def open_report_workbook(filepath):
+    """Open a .xls report with python-calamine, or xlrd (on_demand) if calamine is missing or rejects the file"""
+    if CalamineWorkbook is not None:
+        try:
+            return CalamineBook(filepath)
+        except Exception:
+            pass
+    return xlrd.open_workbook(filepath, on_demand=True)
+
 def process_report_file(args):
-    """Process a single report file - now with robust fallback from OLD to NEW hour extraction."""
-    filepath, filename, target_date, template_map = args
-    print(f"\n🔍 REPORT DEBUG: Starting {filename}")
+    """Process a single report file - now with robust fallback from OLD to NEW hour extraction.
+
+    Matching to a template happens afterwards in the parent process, so this stays picklable and side-effect free."""
+    filepath, filename, target_day = args
+    log.debug("🔍 REPORT DEBUG: Starting %s", filename)
 
     # Step 1: Validate file
     if not is_valid_file(filename, ".xls"):
-        print(f"    ❌ Invalid file type")
+        log.debug("❌ Invalid file type: %s", filename)
         if filename.startswith('._'):
             return None, (filename, "Mac OS hidden file, skipped")
         else:
             return None, (filename, "Not .xls, skipped")
 
-    print(f"    ✅ Valid .xls file")
+    log.debug("✅ Valid .xls file: %s", filename)
 
-    # Step 2: Open workbook
+    # Step 2: Open workbook; sheets are parsed only when asked for, and the with below releases the file
     try:
-        wb = xlrd.open_workbook(filepath)
+        wb = open_report_workbook(filepath)
     except Exception as e:
         return None, (filename, f"Failed to open workbook: {str(e)[:50]}")
 
+    with wb:
+        return _read_report_sheets(wb, filename, target_day)
+
+
+def _read_report_sheets(wb, filename, target_day):
+    """Steps 3-8 of process_report_file, on an open on_demand workbook"""
+
     # Step 3: Extract sheets
     if "Sheet3" not in wb.sheet_names() or "Sheet2" not in wb.sheet_names():
         return None, (filename, "Missing Sheet3 or Sheet2")
     ws3 = wb.sheet_by_name("Sheet3")
-    ws2 = wb.sheet_by_name("Sheet2")
 
     # Step 4: Parse report date
     try:
@@ -436,13 +859,13 @@ def process_report_file(args):
         if isinstance(raw_date, float):
             report_date = datetime(*xlrd.xldate_as_tuple(raw_date, wb.datemode)).date()
         else:
-            report_date = pd.to_datetime(raw_date).date()
+            report_date = coerce_date(raw_date)
     except Exception as e:
         return None, (filename, f"Invalid date format: {str(e)[:50]}")
 
-    if target_date:
-        if report_date != datetime.strptime(target_date, "%Y-%m-%d").date():
-            return None, (filename, f"Date mismatch: report has {report_date}, looking for {target_date}")
+    if target_day:
+        if report_date != target_day:
+            return None, (filename, f"Date mismatch: report has {report_date}, looking for {target_day}")
 
     # Step 5: Extract facility name
     try:
@@ -453,17 +876,19 @@ def process_report_file(args):
         return None, (filename, f"Failed to extract facility name: {str(e)[:50]}")
 
     # Step 6: Extract hours
-    print(f"    📊 Extracting hours data...")
+    log.debug("📊 Extracting hours data from %s", filename)
     try:
         # Try old method
         try:
-            old_actual_hours = safe_float_conversion(ws3.cell_value(13, 7))
-            old_actual_cna_hours = safe_float_conversion(ws3.cell_value(12, 7))
-            old_actual_rn_hours = safe_float_conversion(ws3.cell_value(10, 7))
-            old_actual_lpn_hours = safe_float_conversion(ws3.cell_value(11, 7))
+            # Rows 11-14 of column H in one call: RN, LPN, CNA, total
+            old_rn, old_lpn, old_cna, old_hours = ws3.col_values(7, 10, 14)
+            old_actual_hours = safe_float_conversion(old_hours)
+            old_actual_cna_hours = safe_float_conversion(old_cna)
+            old_actual_rn_hours = safe_float_conversion(old_rn)
+            old_actual_lpn_hours = safe_float_conversion(old_lpn)
             old_total = old_actual_rn_hours + old_actual_lpn_hours + old_actual_cna_hours
-        except:
-            print(f"    ⚠️ OLD method failed, using new method only")
+        except (IndexError, ValueError):  # No column H, or fewer than 14 rows
+            log.debug("⚠️ OLD method failed for %s, using new method only", filename)
             old_actual_hours = old_actual_cna_hours = old_actual_rn_hours = old_actual_lpn_hours = old_total = 0
 
         # Always attempt new method
@@ -484,9 +909,10 @@ def process_report_file(args):
     except Exception as e:
         return None, (filename, f"Failed to extract hours data: {str(e)[:50]}")
 
-    # Step 7: Agency extraction
+    # Step 7: Agency extraction; Sheet2 is only loaded for reports that got this far, after Sheet3 is let go
+    wb.unload_sheet("Sheet3")
     try:
-        agency_data = extract_agency_cna_rnlpn_from_sheet2(ws2)
+        agency_data = extract_agency_cna_rnlpn_from_sheet2(wb.sheet_by_name("Sheet2"))
         agency_percentages = compute_agency_percentages(
             agency_data,
             actual_cna_hours,
@@ -496,31 +922,10 @@ def process_report_file(args):
     except Exception as e:
         return None, (filename, f"Failed to extract agency data: {str(e)[:50]}")
 
-    # Step 8: Template matching
-    matched_template_name = match_report_to_template(report_facility, template_map)
-    if not matched_template_name:
-        return None, (filename, f"No matched facility name. Report: '{extract_core_from_report(report_facility)}'")
-
-    # ✅ STEP 3: DEBUG TRACKING
-    if matched_template_name not in comparison_debug_log:
-        comparison_debug_log[matched_template_name] = {
-            "Template Loaded": False,
-            "Census Valid": False,
-            "Report Found": True,
-            "Report Loaded": True,
-            "Compared": False,
-            "Failure Reason": "Template missing"
-        }
-    else:
-        comparison_debug_log[matched_template_name]["Report Found"] = True
-        comparison_debug_log[matched_template_name]["Report Loaded"] = True
-
-
-    # Step 9: Package result
+    # Step 8: Package result
     return {
         "filename": filename,
         "report_facility": report_facility,
-        "matched_template_name": matched_template_name,
         "report_date": report_date,
         "actual_hours": actual_hours,
         "actual_cna_hours": actual_cna_hours,
@@ -529,72 +934,156 @@ def process_report_file(args):
         "actual_agency_nurse_pct": agency_percentages['actual_agency_nurse_pct'],
         "actual_agency_total_pct": agency_percentages['actual_agency_total_pct']
     }, None
-comparison_debug_log = {}
+
+# One pool per process, shared by every run: concurrent web jobs queue their files on the same workers
+# instead of each starting its own set (each worker holds numpy, openpyxl, calamine and rapidfuzz)
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def parse_worker_count():
+    """CPUs this process may run on (not the host's count, inside a container), capped by HPPD_PARSE_WORKERS if set"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not on Linux
+        cpus = os.cpu_count() or 1
+    limit = os.environ.get("HPPD_PARSE_WORKERS")
+    return max(1, min(cpus, int(limit))) if limit else cpus
+
+def parse_pool():
+    """The shared process pool for parsing workbooks; openpyxl/xlrd parsing is CPU-bound Python, so threads would share one core.
+
+    Workers come from a forkserver with this module preloaded where the platform has one: cheap to start, and
+    nothing is forked from a parent that may be running other threads (e.g. the web app's job threads)."""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                ctx = multiprocessing.get_context("forkserver")
+                ctx.set_forkserver_preload([__name__])
+            else:
+                ctx = multiprocessing.get_context()
+            _parse_pool = concurrent.futures.ProcessPoolExecutor(max_workers=parse_worker_count(), mp_context=ctx)
+        return _parse_pool
+
+def parse_map(fn, args):
+    """list(map(fn, args)), run in the shared parse pool"""
+    global _parse_pool
+    pool = parse_pool()
+    try:
+        return list(pool.map(fn, args, chunksize=4))
+    except concurrent.futures.process.BrokenProcessPool:
+        # A worker died (e.g. killed for memory); this run fails, the next one gets a fresh pool
+        with _parse_pool_lock:
+            if _parse_pool is pool:
+                _parse_pool = None
+        raise
+
+def display_value(value):
+    """A comparison row value as written to the sheet: numbers to 2 decimal places, anything else as is"""
+    if not isinstance(value, (int, float)):
+        return value
+    rounded = round(value, 2)
+    return rounded if rounded else 0.0  # -0.0 would show as "-0" and be colored as a negative difference
+
+SKIPPED_COLUMN_WIDTHS = (40, 50, 20)  # File Name, Reason, Category on the skipped sheets
+
+def _set_widths(ws, widths):
+    """Set the widths of a sheet's first columns, A onwards; in write-only mode this must happen before any append"""
+    dimensions = ws.column_dimensions
+    for letter, width in zip(string.ascii_uppercase, widths):
+        dimensions[letter].width = width
+
+def _emit_skipped_sheet(wb, title, skipped, empty_msg):
+    """Add a sheet listing skipped files, from (filename, reason, category) rows; an empty list gets a one-cell empty_msg row"""
+    ws = wb.create_sheet(title=title)
+    _set_widths(ws, SKIPPED_COLUMN_WIDTHS)
+    ws.append(("File Name", "Reason", "Category"))
+    for skip in skipped or [(empty_msg,)]:
+        ws.append(skip)
+    return ws
+
+def save_output_workbook(wb, path):
+    """wb.save(path), but with the fastest DEFLATE level: a little larger file for several times less compression time"""
+    wb.properties.modified = datetime.now(tz=timezone.utc).replace(tzinfo=None)
+    archive = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, allowZip64=True, compresslevel=1)
+    ExcelWriter(wb, archive).save()  # Closes the archive
+
+# Skip reasons repeat (hidden files, missing names), so the categories are cached by reason
+@lru_cache(maxsize=128)
+def template_skip_category(reason):
+    """Category column of the Skipped Templates sheet"""
+    return "Mac OS Hidden File" if "Mac OS hidden" in reason else "Invalid Data" if "Invalid" in reason else "File Error"
+
+@lru_cache(maxsize=128)
+def report_skip_category(reason):
+    """Category column of the Skipped Reports sheet"""
+    return "Mac OS Hidden File" if "Mac OS hidden" in reason else "Name Matching Issue" if "No matched facility" in reason else "File Error"
 
 def run_hppd_comparison_for_date(templates_folder, reports_folder, target_date, output_path, progress_callback=None):
-    print("Starting HPPD comparison...")
+    """templates_folder/reports_folder are folders or iterables of (filepath, filename), see iter_input_files.
+
+    Workbooks are parsed in worker processes (see parse_pool), so a script calling this
+    needs the usual `if __name__ == "__main__":` guard."""
+    log.info("Starting HPPD comparison...")
+    clear_name_caches()
+    # Per run: rows from an earlier (or concurrent) run must not reach this workbook's debug sheet
+    comparison_debug_log = {}
+    # Parsed once here; the workers get the date itself
+    target_day = datetime.strptime(target_date, "%Y-%m-%d").date() if target_date else None
     
     def progress(pct, msg):
         if progress_callback:
             progress_callback(pct, msg)
-        print(f"Progress {pct}%: {msg}")
+        log.info("Progress %s%%: %s", pct, msg)
 
     progress(5, "Collecting template files...")
 
-    # Collect template files
-    template_files = []
-    for root, _, files in os.walk(templates_folder):
-        for fname in files:
-            template_files.append((os.path.join(root, fname), fname, target_date))
-    print(f"Found {len(template_files)} template files.\n")
+    # Collect template files lazily; each one is queued for parsing as soon as it is available
+    template_files = ((filepath, fname, target_day) for filepath, fname in iter_input_files(templates_folder))
 
     # ─── PHASE 1: PROCESS TEMPLATE FILES ─────────────────────────
     template_entries = []
     skipped_templates = []
     progress(15, "Processing template files...")
 
-    # Process templates in parallel
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-        results = executor.map(process_template_file, template_files)
-        
-        for entry, skip_info in results:
-            if entry:
-                template_entries.append(entry)
-
-                # DEBUG TRACKING (Step 2)
-                facility = entry["facility"]
-                comparison_debug_log[facility] = {
-                    "Template Loaded": True,
-                    "Census Valid": entry["census"] > 0,
-                    "Report Found": False,
-                    "Report Loaded": False,
-                    "Compared": False,
-                    "Failure Reason": None
-                }
-                if entry["census"] <= 0:
-                    comparison_debug_log[facility]["Failure Reason"] = "Invalid census (0)"
+    # Parse templates in parallel, in worker processes
+    for entry, skip_info in parse_map(process_template_file, template_files):
+        if entry:
+            template_entries.append(entry)
+
+            # DEBUG TRACKING (Step 2)
+            facility = entry.facility
+            comparison_debug_log[facility] = {
+                "Template Loaded": True,
+                "Census Valid": entry.census > 0,
+                "Report Found": False,
+                "Report Loaded": False,
+                "Compared": False,
+                "Failure Reason": None
+            }
+            if entry.census <= 0:
+                comparison_debug_log[facility]["Failure Reason"] = "Invalid census (0)"
 
-            elif skip_info:
-                skipped_templates.append(skip_info)
+        elif skip_info:
+            filename, reason = skip_info
+            skipped_templates.append((filename, reason, template_skip_category(reason)))
 
 
-    print(f"Processed templates: {len(template_entries)} entries, {len(skipped_templates)} skipped\n")
+    log.info("Found %d template files.", len(template_entries) + len(skipped_templates))
+    log.info("Processed templates: %d entries, %d skipped", len(template_entries), len(skipped_templates))
 
     # ─── PHASE 2: BUILD TEMPLATE MAP ─────────────────────────────
     progress(30, "Building template map...")
     template_map = build_template_name_map(template_entries)
-    print(f"[TEMPLATE MAP] {len(template_map)} keys")
-    for clean, full in template_map.items():
-        print(f"  • '{clean}' → '{full}'")
-    print()
+    cleaned_names, facilities = build_template_names(template_map)
+    log.info("[TEMPLATE MAP] %d keys", len(template_map))
+    if log.isEnabledFor(logging.DEBUG):
+        for clean, full in template_map.items():
+            log.debug("  • '%s' → '%s'", clean, full)
 
     # ─── PHASE 3: PROCESS REPORT FILES ───────────────────────────
     progress(40, "Collecting report files...")
-    report_files = []
-    for root, _, files in os.walk(reports_folder):
-        for fname in files:
-            report_files.append((os.path.join(root, fname), fname, target_date, template_map))
-    print(f"Found {len(report_files)} report files.\n")
+    report_files = ((filepath, fname, target_day) for filepath, fname in iter_input_files(reports_folder))
 
     # Process reports and collect detailed failure information
     progress(50, "Processing report files...")
@@ -607,337 +1096,300 @@ def run_hppd_comparison_for_date(templates_folder, reports_folder, target_date,
     sheet_failures = []
     data_failures = []
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as ex:
-        for rep, skip in ex.map(process_report_file, report_files):
-            if rep: 
-                report_data_list.append(rep)
-            elif skip:
-                skipped_reports.append(skip)
-                # Categorize the failure type
-                filename, reason = skip
-                if "Date mismatch" in reason:
-                    date_failures.append((filename, reason))
-                elif "No matched facility" in reason:
-                    matching_failures.append((filename, reason))
-                elif "Mac OS hidden" in reason or "Not .xls" in reason:
-                    file_failures.append((filename, reason))
-                elif "No Sheet" in reason:
-                    sheet_failures.append((filename, reason))
+    parsed_reports = parse_map(process_report_file, report_files)
+
+    # Template matching runs here rather than in the workers: the map and debug log live in this process.
+    # All parsed reports are matched in one batch, so their fuzzy scores come from a single cdist call.
+    matched_names = iter(match_reports_to_templates(
+        [rep["report_facility"] for rep, _ in parsed_reports if rep],
+        cleaned_names, facilities, template_map
+    ))
+
+    for rep, skip in parsed_reports:
+        if rep:
+            matched_template_name = next(matched_names)
+            if not matched_template_name:
+                rep, skip = None, (rep["filename"], f"No matched facility name. Report: '{extract_core_from_report(rep['report_facility'])}'")
+            else:
+                rep["matched_template_name"] = matched_template_name
+
+                # ✅ STEP 3: DEBUG TRACKING
+                if matched_template_name not in comparison_debug_log:
+                    comparison_debug_log[matched_template_name] = {
+                        "Template Loaded": False,
+                        "Census Valid": False,
+                        "Report Found": True,
+                        "Report Loaded": True,
+                        "Compared": False,
+                        "Failure Reason": "Template missing"
+                    }
                 else:
-                    data_failures.append((filename, reason))
+                    comparison_debug_log[matched_template_name]["Report Found"] = True
+                    comparison_debug_log[matched_template_name]["Report Loaded"] = True
+
+        if rep:
+            report_data_list.append(rep)
+        elif skip:
+            # Categorize the failure type
+            filename, reason = skip
+            skipped_reports.append((filename, reason, report_skip_category(reason)))
+            if "Date mismatch" in reason:
+                date_failures.append((filename, reason))
+            elif "No matched facility" in reason:
+                matching_failures.append((filename, reason))
+            elif "Mac OS hidden" in reason or "Not .xls" in reason:
+                file_failures.append((filename, reason))
+            elif "No Sheet" in reason:
+                sheet_failures.append((filename, reason))
+            else:
+                data_failures.append((filename, reason))
+
+    report_count = len(report_data_list) + len(skipped_reports)
+    log.info("Found %d report files.", report_count)
 
     # Print comprehensive summary
-    print(f"\n" + "="*80)
-    print(f"📊 COMPREHENSIVE REPORT PROCESSING SUMMARY")
-    print(f"="*80)
-    print(f"Total reports attempted: {len(report_files)}")
-    print(f"✅ Successfully processed: {len(report_data_list)}")
-    print(f"❌ Total skipped: {len(skipped_reports)}")
-    print(f"")
-    print(f"FAILURE BREAKDOWN:")
-    print(f"📅 Date mismatches: {len(date_failures)}")
-    print(f"🔗 Template matching failures: {len(matching_failures)}")
-    print(f"📁 File issues (hidden/wrong extension): {len(file_failures)}")
-    print(f"📋 Missing sheets: {len(sheet_failures)}")
-    print(f"📊 Data extraction issues: {len(data_failures)}")
-    print(f"")
+    log.info("=" * 80)
+    log.info("📊 COMPREHENSIVE REPORT PROCESSING SUMMARY")
+    log.info("=" * 80)
+    log.info("Total reports attempted: %d", report_count)
+    log.info("✅ Successfully processed: %d", len(report_data_list))
+    log.info("❌ Total skipped: %d", len(skipped_reports))
+    log.info("FAILURE BREAKDOWN:")
+    log.info("📅 Date mismatches: %d", len(date_failures))
+    log.info("🔗 Template matching failures: %d", len(matching_failures))
+    log.info("📁 File issues (hidden/wrong extension): %d", len(file_failures))
+    log.info("📋 Missing sheets: %d", len(sheet_failures))
+    log.info("📊 Data extraction issues: %d", len(data_failures))
 
     # Show specific examples of each failure type
     if date_failures:
-        print(f"📅 DATE FAILURE EXAMPLES:")
+        log.info("📅 DATE FAILURE EXAMPLES:")
         for filename, reason in date_failures[:3]:
-            print(f"  • {filename}: {reason}")
+            log.info("  • %s: %s", filename, reason)
         if len(date_failures) > 3:
-            print(f"  ... and {len(date_failures) - 3} more")
-        print()
+            log.info("  ... and %d more", len(date_failures) - 3)
 
     if matching_failures:
-        print(f"🔗 MATCHING FAILURE EXAMPLES:")
+        log.info("🔗 MATCHING FAILURE EXAMPLES:")
         for filename, reason in matching_failures[:5]:
-            print(f"  • {filename}: {reason}")
+            log.info("  • %s: %s", filename, reason)
         if len(matching_failures) > 5:
-            print(f"  ... and {len(matching_failures) - 5} more")
-        print()
+            log.info("  ... and %d more", len(matching_failures) - 5)
 
     if file_failures:
-        print(f"📁 FILE ISSUE EXAMPLES:")
+        log.info("📁 FILE ISSUE EXAMPLES:")
         for filename, reason in file_failures[:3]:
-            print(f"  • {filename}: {reason}")
+            log.info("  • %s: %s", filename, reason)
         if len(file_failures) > 3:
-            print(f"  ... and {len(file_failures) - 3} more")
-        print()
+            log.info("  ... and %d more", len(file_failures) - 3)
 
     if sheet_failures:
-        print(f"📋 SHEET ISSUE EXAMPLES:")
+        log.info("📋 SHEET ISSUE EXAMPLES:")
         for filename, reason in sheet_failures[:3]:
-            print(f"  • {filename}: {reason}")
+            log.info("  • %s: %s", filename, reason)
         if len(sheet_failures) > 3:
-            print(f"  ... and {len(sheet_failures) - 3} more")
-        print()
+            log.info("  ... and %d more", len(sheet_failures) - 3)
 
     if data_failures:
-        print(f"📊 DATA ISSUE EXAMPLES:")
+        log.info("📊 DATA ISSUE EXAMPLES:")
         for filename, reason in data_failures[:3]:
-            print(f"  • {filename}: {reason}")
+            log.info("  • %s: %s", filename, reason)
         if len(data_failures) > 3:
-            print(f"  ... and {len(data_failures) - 3} more")
-        print()
+            log.info("  ... and %d more", len(data_failures) - 3)
 
-    print(f"="*80)
-    print(f"")
+    log.info("=" * 80)
 
     # ─── PHASE 4: MATCH REPORTS TO TEMPLATES ────────────────────
     progress(65, "Matching reports to templates...")
     results = {}
 
+    # Column widths, starting from the header lengths; widened as each facility's rows are built
+    column_widths = [len(header) for header in COLUMN_HEADERS]
+
+    # First template entry per (facility, date)
+    template_by_key = {}
+    for e in template_entries:
+        template_by_key.setdefault((e.facility, e.date), e)
+
     for report_data in report_data_list:
-        print(f"🔍 Matching report '{report_data['filename']}'")
-        print(f"    report_facility       = {report_data['report_facility']!r}")
-        print(f"    matched_template_name = {report_data['matched_template_name']!r}")
-        
-        # Only show entries for that facility
-        print("    RELEVANT template_entries:")
-        relevant_entries = [e for e in template_entries if e["facility"] == report_data["matched_template_name"]]
-        for e in relevant_entries:
-            print(f"      • facility={e['facility']!r}, date={e['date']!r}")
-        
-        # Check available dates
-        dates = [e["date"] for e in template_entries if e["facility"] == report_data["matched_template_name"]]
-        print(f"    template dates for '{report_data['matched_template_name']}': {dates}")
-        print(f"    report_date needed: {report_data['report_date']}")
-
-        candidates = [
-            e for e in template_entries
-            if e["facility"] == report_data["matched_template_name"]
-            and e["date"] == report_data["report_date"]
-        ]
+        log.debug(
+            "🔍 Matching report '%s': report_facility=%r, matched_template_name=%r, report_date=%s",
+            report_data["filename"], report_data["report_facility"],
+            report_data["matched_template_name"], report_data["report_date"],
+        )
+
+        t = template_by_key.get((report_data["matched_template_name"], report_data["report_date"]))
         
-        if not candidates:
-            skipped_reports.append((report_data["filename"], f"No matched date {report_data['report_date']}"))
-            print("    ❌ No candidates, skipping\n")
+        if t is None:
+            reason = f"No matched date {report_data['report_date']}"
+            skipped_reports.append((report_data["filename"], reason, report_skip_category(reason)))
+            log.debug("❌ No template for that date, skipping %s", report_data["filename"])
             continue
 
         # Build results
-        t = candidates[0]
-        comparison_debug_log[t["facility"]]["Compared"] = True
-        key = (t["facility"], report_data["report_date"])
+        comparison_debug_log[t.facility]["Compared"] = True
+        key = (t.facility, report_data["report_date"])
         
         # Calculate actual HPPD values
-        actual_hppd = report_data["actual_hours"] / t["census"] if t["census"] > 0 else 0
-        actual_cna_hppd = report_data["actual_cna_hours"] / t["census"] if t["census"] > 0 else 0
-        actual_rn_lpn_hppd = report_data["actual_rn_lpn_hours"] / t["census"] if t["census"] > 0 else 0
-
-        results[key] = [
-            {
-                "Facility": t["facility"],
-                "Type": "Projected",
-                "Total HPPD": round(t["proj_total"], 2),
-                "CNA HPPD": round(t["proj_cna"], 2),
-                "RN+LPN HPPD": round(t["proj_nurse"], 2),
-                "CNA Agency %": round(t["proj_agency_cna"], 2),
-                "RN+LPN Agency %": round(t["proj_agency_nurse"], 2),
-                "Total Agency %": round(t["proj_agency_total"], 2),
-                "Notes": t.get("note", ""),
-                "Date": report_data["report_date"]
-            },
-            {
-                "Facility": t["facility"],
-                "Type": "Actual",
-                "Total HPPD": round(actual_hppd, 2),
-                "CNA HPPD": round(actual_cna_hppd, 2),
-                "RN+LPN HPPD": round(actual_rn_lpn_hppd, 2),
-                "CNA Agency %": report_data["actual_agency_cna_pct"],
-                "RN+LPN Agency %": report_data["actual_agency_nurse_pct"],
-                "Total Agency %": report_data["actual_agency_total_pct"],
-                "Notes": t.get("note", ""),
-                "Date": report_data["report_date"]
-            }
-        ]
-        print("    ✅ Matched and will be included\n")
+        actual_hppd = report_data["actual_hours"] / t.census if t.census > 0 else 0
+        actual_cna_hppd = report_data["actual_cna_hours"] / t.census if t.census > 0 else 0
+        actual_rn_lpn_hppd = report_data["actual_rn_lpn_hours"] / t.census if t.census > 0 else 0
+
+        # Rows in COLUMN_HEADERS order; only the Projected row shows the facility name
+        projected_row, actual_row = (
+            (
+                t.facility,
+                "Projected",
+                t.proj_total,
+                t.proj_cna,
+                t.proj_nurse,
+                t.proj_agency_cna,
+                t.proj_agency_nurse,
+                t.proj_agency_total,
+                t.note,
+                report_data["report_date"]
+            ),
+            (
+                "",
+                "Actual",
+                actual_hppd,
+                actual_cna_hppd,
+                actual_rn_lpn_hppd,
+                report_data["actual_agency_cna_pct"],
+                report_data["actual_agency_nurse_pct"],
+                report_data["actual_agency_total_pct"],
+                t.note,
+                report_data["report_date"]
+            )
+        )
+        # Taken between the values as displayed, so each Difference cell equals the Projected and Actual cells
+        # above it; the rows keep unrounded values and everything is rounded when written (see display_value)
+        differences = tuple(
+            display_value(proj_val) - display_value(act_val)
+            if isinstance(proj_val, (int, float)) and isinstance(act_val, (int, float)) else None
+            for proj_val, act_val in zip(projected_row[DIFF_SLICE], actual_row[DIFF_SLICE])
+        )
+        difference_row = ("", "Difference", *differences, report_data["report_date"])
 
-    print(f"Generated results for {len(results)} facilities")
+        # Each facility's three rows are kept together
+        results[key] = (projected_row, actual_row, difference_row)
+        for row_data in results[key]:
+            for col_idx, val in enumerate(row_data):
+                column_widths[col_idx] = max(column_widths[col_idx], len(str(display_value(val))))
+        log.debug("✅ Matched and will be included: %s", report_data["filename"])
+
+    log.info("Generated results for %d facilities", len(results))
 
     # ─── PHASE 5: EXCEL GENERATION ───────────────────────────────
     progress(80, "Generating Excel output...")
     
-    # Pre-calculate all difference rows and column widths
-    all_difference_rows = {}
-    column_headers = [
-        "Facility", "Type", "Total HPPD", "CNA HPPD", "RN+LPN HPPD",
-        "CNA Agency %", "RN+LPN Agency %", "Total Agency %",
-        "Notes", "Date"
+    comparison_rows = list(results.values())
+
+    # Create output Excel file; write-only mode streams each row out instead of keeping every cell in memory
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("HPPD Comparison")
+
+    # Registered once per workbook, so each data cell takes its font, fill and number format in one assignment
+    for name, font, fill in ROW_STYLES:
+        wb.add_named_style(NamedStyle(name=name, font=font, fill=fill))
+        wb.add_named_style(NamedStyle(name=f"{name} Date", font=font, fill=fill,
+                                      number_format=numbers.FORMAT_DATE_YYYYMMDD2))
+
+    # Categorize results on the actual rows as displayed, all facilities at once
+    hppd, cna, rn = (
+        np.fromiter((display_value(actual_row[col]) for _, actual_row, _ in comparison_rows), dtype=np.float64, count=len(comparison_rows))
+        for col in (COLUMN_INDEX["Total HPPD"], COLUMN_INDEX["CNA HPPD"], COLUMN_INDEX["RN+LPN HPPD"])
+    )
+    good_hppd = (hppd >= 3.0) & (hppd <= 3.3)
+    good_split = (cna >= 2.00) & (cna <= 2.06) & (rn <= 1.2)
+    bad_split = (cna < 2.0) | (rn > 1.2)  # never true together with good_split
+    group1 = [comparison_rows[i] for i in np.flatnonzero(good_hppd & good_split)]
+    group2 = [comparison_rows[i] for i in np.flatnonzero(good_hppd & bad_split)]
+    group3 = [comparison_rows[i] for i in np.flatnonzero(~good_hppd & bad_split)]
+
+    sections = [
+        ("Good HPPD & Good Split (3.0<HPPD<3.3, 2.00<CNA<2.06, RN+LPN<=1.20)", group1),
+        ("Good HPPD & Bad Split (3.0<HPPD<3.3, CNA<2.00, RN+LPN>1.20)", group2),
+        ("Bad HPPD & Bad Split (HPPD>3.3 | HPPD<3.0, CNA<2.00, RN+LPN>1.20)", group3),
     ]
-    
-    # Initialize column widths with header lengths
-    column_widths = {header: len(header) for header in column_headers}
-    
-    for key in results.keys():
-        projected_row = results[key][0]
-        actual_row = results[key][1]
-        
-        difference_row = {"Type": "Difference", "Facility": "", "Date": projected_row["Date"]}
-        for col_name in column_headers:
-            if col_name in ("Facility", "Type", "Date"):
-                continue
-            proj_val = projected_row.get(col_name)
-            act_val = actual_row.get(col_name)
-            if isinstance(proj_val, (int, float)) and isinstance(act_val, (int, float)):
-                difference_row[col_name] = round(proj_val - act_val, 2)
-            else:
-                difference_row[col_name] = None
-        
-        all_difference_rows[key] = difference_row
-        
-        # Calculate column widths
-        for row_data in [projected_row, actual_row, difference_row]:
-            for header in column_headers:
-                if header == "Facility" and row_data["Type"] in ["Actual", "Difference"]:
-                    content = ""
-                else:
-                    content = str(row_data.get(header, ""))
-                
-                content_width = len(content)
-                column_widths[header] = max(column_widths[header], content_width)
-    
-    # Create output Excel file
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "HPPD Comparison"
-    current_row = 1
-    header_written = False
-
-    def write_section(title, keys):
-        nonlocal current_row, header_written
-        ws.cell(row=current_row, column=1, value=title).font = Font(bold=True, size=20)
-        current_row += 1
-
-        if not keys:
-            ws.cell(row=current_row, column=1, value="No data available for this category.")
-            current_row += 2
+
+    # Column widths and frozen panes are written ahead of the rows, so both are set before anything is appended.
+    # Freeze below the first section's column header row; a section without data takes up three rows.
+    for col_letter, width in zip(COLUMN_LETTERS, column_widths):
+        ws.column_dimensions[col_letter].width = width + 4
+    section_row = 1
+    for title, section_rows in sections:
+        if section_rows:
+            ws.freeze_panes = f"A{section_row + 2}"
+            break
+        section_row += 3
+
+    def write_section(title, section_rows):
+        title_cell = WriteOnlyCell(ws, value=title)
+        title_cell.font = FONT_TITLE
+        ws.append([title_cell])
+
+        if not section_rows:
+            ws.append(["No data available for this category."])
+            ws.append([])
             return
 
-        for col_idx, col_name in enumerate(column_headers, 1):
-            cell = ws.cell(row=current_row, column=col_idx, value=col_name)
-            cell.font = Font(bold=True, size=16)
-            cell.alignment = Alignment(horizontal="center", vertical="center")
+        header_cells = []
+        for col_name in COLUMN_HEADERS:
+            cell = WriteOnlyCell(ws, value=col_name)
+            cell.font = FONT_HEADER
+            cell.alignment = ALIGN_CENTER
+            header_cells.append(cell)
+        ws.append(header_cells)
+
+        for projected_row, actual_row, difference_row in section_rows:
+            for row_data in (projected_row, actual_row, difference_row):
+                row_cells = []
+                for val, style in zip(row_data, COLUMN_STYLES[row_data[COLUMN_INDEX["Type"]]]):
+                    val = display_value(val)
+                    cell = WriteOnlyCell(ws, value=val)
+
+                    # Color coding for the Difference row's red/green columns
+                    if style is None:
+                        if isinstance(val, (int, float)):
+                            style = "HPPD Difference Good" if val < 0 else "HPPD Difference Bad"
+                        else:
+                            style = "HPPD Difference Neutral"
 
-        if not header_written:
-            ws.freeze_panes = ws.cell(row=current_row + 1, column=1)
-            header_written = True
+                    cell.style = style
+                    row_cells.append(cell)
+                ws.append(row_cells)
 
-        current_row += 1
+        ws.append([])
+        ws.append([])
 
-        for key in keys:
-            projected_row = results[key][0]
-            actual_row = results[key][1]
-            difference_row = all_difference_rows[key]
+    for title, section_rows in sections:
+        write_section(title, section_rows)
 
-            for row_data in [projected_row, actual_row, difference_row]:
-                for col_idx, col_name in enumerate(column_headers, 1):
-                    if col_name == "Facility" and row_data["Type"] in ["Actual", "Difference"]:
-                        val = ""
-                    else:
-                        val = row_data.get(col_name, "")
-                    
-                    cell = ws.cell(row=current_row, column=col_idx, value=val)
-                    cell.font = Font(size=14, italic=(row_data["Type"] == "Difference"))
-                    
-                    # Color coding for rows
-                    if row_data["Type"] == "Projected":
-                        cell.fill = PatternFill("solid", fgColor="D1CFCF")
-                    elif row_data["Type"] == "Actual":
-                        cell.fill = PatternFill("solid", fgColor="FFFFFF")
-                    elif row_data["Type"] == "Difference":
-                        red_green_cols = (
-                            "Total HPPD", "CNA HPPD", "RN+LPN HPPD",
-                            "CNA Agency %", "RN+LPN Agency %", "Total Agency %"
-                        )
-                        if col_name in red_green_cols:
-                            diff_val = difference_row.get(col_name)
-                            if isinstance(diff_val, (int, float)):
-                                if diff_val < 0:
-                                    cell.fill = PatternFill("solid", fgColor="C8E6C9")
-                                else:
-                                    cell.fill = PatternFill("solid", fgColor="FFCDD2")
-                            else:
-                                cell.fill = PatternFill("solid", fgColor="FFFACD")
-                        else:
-                            cell.fill = PatternFill("solid", fgColor="FFFFFF")
-                    
-                    if col_name == "Date":
-                        cell.number_format = numbers.FORMAT_DATE_YYYYMMDD2
-                        
-                current_row += 1
-
-        current_row += 2
-
-    # Categorize results
-    group1, group2, group3 = [], [], []
-    for key, rows in results.items():
-        actual = rows[1]
-        hppd = actual["Total HPPD"]
-        cna = actual["CNA HPPD"]
-        rn = actual["RN+LPN HPPD"]
-        if 3.0 <= hppd <= 3.3 and 2.00 <= cna <= 2.06 and rn <= 1.2:
-            group1.append(key)
-        elif 3.0 <= hppd <= 3.3 and (cna < 2.0 or rn > 1.2):
-            group2.append(key)
-        elif (hppd < 3.0 or hppd > 3.3) and (cna < 2.0 or rn > 1.2):
-            group3.append(key)
-
-    write_section("Good HPPD & Good Split (3.0<HPPD<3.3, 2.00<CNA<2.06, RN+LPN<=1.20)", group1)
-    write_section("Good HPPD & Bad Split (3.0<HPPD<3.3, CNA<2.00, RN+LPN>1.20)", group2)
-    write_section("Bad HPPD & Bad Split (HPPD>3.3 | HPPD<3.0, CNA<2.00, RN+LPN>1.20)", group3)
-
-    # Set column widths
-    for col_idx, header in enumerate(column_headers, 1):
-        col_letter = get_column_letter(col_idx)
-        ws.column_dimensions[col_letter].width = column_widths[header] + 4
-
-    # Add skipped templates sheet
-    ws_skipped = wb.create_sheet(title="Skipped Templates")
-    ws_skipped.append(["File Name", "Reason", "Category"])
-    for filename, reason in skipped_templates:
-        category = "Mac OS Hidden File" if "Mac OS hidden" in reason else "Invalid Data" if "Invalid" in reason else "File Error"
-        ws_skipped.append([filename, reason, category])
-    if not skipped_templates:
-        ws_skipped.append(["✅ No skipped templates", "", ""])
-    ws_skipped.column_dimensions["A"].width = 40
-    ws_skipped.column_dimensions["B"].width = 50
-    ws_skipped.column_dimensions["C"].width = 20
-
-    # Add skipped reports sheet
-    ws_skipped_reports = wb.create_sheet(title="Skipped Reports")
-    ws_skipped_reports.append(["File Name", "Reason", "Category"])
-    for filename, reason in skipped_reports:
-        category = "Mac OS Hidden File" if "Mac OS hidden" in reason else "Name Matching Issue" if "No matched facility" in reason else "File Error"
-        ws_skipped_reports.append([filename, reason, category])
-    if not skipped_reports:
-        ws_skipped_reports.append(["✅ No skipped reports", "", ""])
-    ws_skipped_reports.column_dimensions["A"].width = 40
-    ws_skipped_reports.column_dimensions["B"].width = 50
-    ws_skipped_reports.column_dimensions["C"].width = 20
+    # Add skipped templates and skipped reports sheets
+    _emit_skipped_sheet(wb, "Skipped Templates", skipped_templates, "✅ No skipped templates")
+    _emit_skipped_sheet(wb, "Skipped Reports", skipped_reports, "✅ No skipped reports")
 
     # ✅ STEP 5: Write comparison debug log
+    import pandas as pd  # Only needed for this sheet; the parse workers (forkserver preload) don't load it
     debug_df = pd.DataFrame.from_dict(comparison_debug_log, orient='index')
     debug_df.index.name = "Facility"
     debug_df.reset_index(inplace=True)
 
     ws_debug = wb.create_sheet(title="Comparison Debug Log")
-    ws_debug.append(debug_df.columns.tolist())
-    for row in debug_df.itertuples(index=False):
-        ws_debug.append(list(row))
 
-    # Optional: widen columns for clarity
-    for col_idx, col_name in enumerate(debug_df.columns, 1):
-        col_letter = get_column_letter(col_idx)
-        ws_debug.column_dimensions[col_letter].width = max(15, len(col_name) + 4)
+    # Optional: widen columns for clarity (the log has a handful of fixed columns)
+    _set_widths(ws_debug, [max(15, len(col_name) + 4) for col_name in debug_df.columns])
+
+    ws_debug.append(tuple(debug_df.columns))
+    for row in debug_df.itertuples(index=False, name=None):
+        ws_debug.append(row)
 
     # Save the file
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     final_output_path = os.path.join(output_path, f"HPPD_Comparison_{timestamp}.xlsx")
-    wb.save(final_output_path)
+    save_output_workbook(wb, final_output_path)
     
     progress(100, "✅ Analysis complete!")
-    print("Excel file created successfully!")
+    log.info("Excel file created successfully!")
     return final_output_path
\ No newline at end of file